@@ -6,20 +6,28 @@
 
 """
 
+import base64
 import gzip
 import io
+import multiprocessing
 import os
 import sys
 import unicodedata
 import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 from urllib.parse import urljoin, uses_relative
+from xml.etree import ElementTree
 
 import py
 import pytest
 from PIL import Image
-from weasyprint import CSS, HTML, __main__, default_url_fetcher
+from weasyprint import CSS, HTML, Renderer, __main__, default_url_fetcher
 from weasyprint.document import resolve_links
+from weasyprint.html import (
+    _import_html5_parser, parse_html5_parser, parse_html5lib)
+from weasyprint.images import ImageCache
 from weasyprint.urls import path2url
 
 from .draw import assert_pixels_equal, parse_pixels
@@ -149,6 +157,86 @@ def test_html_parsing():
     _check_doc1(FakeHTML(string=string_with_meta, base_url='.'))
 
 
+@assert_no_logs
+def test_html_parser():
+    """Test custom HTML parsers."""
+    calls = []
+
+    def parser(source, encoding, protocol_encoding):
+        calls.append((encoding, protocol_encoding))
+        return parse_html5lib(source, encoding, protocol_encoding)
+
+    _test_resource(
+        FakeHTML, 'doc1_UTF-16BE.html', _check_doc1, encoding='UTF-16BE',
+        parser=parser)
+    assert calls
+    assert all(encoding == 'UTF-16BE' for encoding, _ in calls)
+
+
+@assert_no_logs
+def test_html5_parser():
+    pytest.importorskip('html5_parser')
+
+    def tree(html):
+        return [
+            (element.tag, sorted(element.attrib.items()), element.text)
+            for element in html.etree_element.iter()]
+
+    for filename in ('doc1.html', 'doc1_UTF-16BE.html'):
+        encoding = 'UTF-16BE' if 'UTF-16BE' in filename else None
+        html = FakeHTML(
+            resource_filename(filename), encoding=encoding,
+            parser=parse_html5_parser)
+        _check_doc1(html)
+        assert tree(html) == tree(FakeHTML(
+            resource_filename(filename), encoding=encoding))
+
+    string = '<p id=a>a<svg viewBox="0 0 1 1"><a xlink:href="#a"/></svg>'
+    assert tree(FakeHTML(string=string, parser=parse_html5_parser)) == (
+        tree(FakeHTML(string=string)))
+
+
+def test_html5_parser_missing(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'html5_parser', None)
+    _import_html5_parser.cache_clear()
+    try:
+        with capture_logs() as logs:
+            for _ in range(2):
+                _check_doc1(FakeHTML(
+                    resource_filename('doc1.html'),
+                    parser=parse_html5_parser))
+    finally:
+        _import_html5_parser.cache_clear()
+    assert len(logs) == 1
+    assert 'html5-parser is not installed' in logs[0]
+
+
+@assert_no_logs
+def test_html_tree():
+    """Test HTML documents created from already parsed trees."""
+    filename = resource_filename('doc1.html')
+    with open(filename, 'rb') as fd:
+        root = parse_html5lib(fd)
+    _check_doc1(FakeHTML(tree=root, base_url=filename))
+    _check_doc1(FakeHTML(tree=ElementTree.ElementTree(root)), False)
+    with pytest.raises(TypeError):
+        FakeHTML(filename, tree=root)
+
+    root = ElementTree.Element('html')
+    ElementTree.SubElement(root, 'head')
+    body = ElementTree.SubElement(root, 'body')
+    ElementTree.SubElement(body, 'p').text = 'abc'
+    html = FakeHTML(tree=root)
+    assert html.etree_element is root
+    page, = html.render().pages
+    html_box, = page._page_box.children
+    body_box, = html_box.children
+    p_box, = body_box.children
+    line, = p_box.children
+    text, = line.children
+    assert text.text == 'abc'
+
+
 @assert_no_logs
 def test_css_parsing():
     """Test the constructor for the CSS class."""
@@ -415,6 +503,40 @@ def test_command_line_render(tmpdir):
         _run('--version')
 
 
+@assert_no_logs
+def test_command_line_render_multiple(tmpdir):
+    tmpdir.chdir()
+    tmpdir.join('one.html').write_binary(b'<p>One')
+    tmpdir.join('two.html').write_binary(b'<p>Two')
+    os.mkdir('out')
+
+    _run('one.html two.html out -j 2 --timeout 60')
+    assert tmpdir.join('out', 'one.pdf').read_binary().startswith(b'%PDF')
+    assert tmpdir.join('out', 'two.pdf').read_binary().startswith(b'%PDF')
+
+    # Outputs of inputs with the same name are not overwritten
+    tmpdir.mkdir('sub').join('one.html').write_binary(b'<p>Other one')
+    _run('one.html sub/one.html out')
+    assert tmpdir.join('out', 'one.pdf').read_binary().startswith(b'%PDF')
+    assert tmpdir.join('out', 'one-2.pdf').read_binary().startswith(b'%PDF')
+
+    with capture_logs() as logs:
+        _run('one.html missing.html out')
+    assert len(logs) == 1
+    assert logs[0].startswith('ERROR: Failed to render')
+
+    with pytest.raises(SystemExit):
+        _run('one.html two.html out.pdf')
+    with pytest.raises(SystemExit):
+        _run('one.html - out')
+
+    # Timeouts and memory limits are only applied to worker processes
+    with pytest.raises(SystemExit):
+        _run('one.html out/one.pdf --timeout 60')
+    with pytest.raises(SystemExit):
+        _run('one.html out/one.pdf -j 2 --memory-limit 500')
+
+
 @assert_no_logs
 def test_unicode_filenames(tmpdir):
     """Test non-ASCII filenames both in Unicode or bytes form."""
@@ -890,6 +1012,54 @@ def test_url_fetcher():
         url_fetcher=fetcher_2).render()
 
 
+@assert_no_logs
+def test_prefetch_resources():
+    with open(resource_filename('pattern.png'), 'rb') as fd:
+        pattern_png = fd.read()
+    with open(resource_filename('weasyprint.otf'), 'rb') as fd:
+        font = fd.read()
+    resources = {
+        'weasyprint-custom:foo/style.css': (
+            b'@import "import.css"; body { background: url(body.png) }',
+            'text/css'),
+        'weasyprint-custom:foo/import.css': (
+            b'@font-face { font-family: a; src: url(font.otf) }', 'text/css'),
+        'weasyprint-custom:foo/font.otf': (font, 'font/otf'),
+    }
+    for name in ('img', 'object', 'body', 'style', 'attribute'):
+        resources[f'weasyprint-custom:foo/{name}.png'] = (
+            pattern_png, 'image/png')
+    fetched = []
+
+    def fetcher(url):
+        fetched.append(url)
+        string, mime_type = resources[url]
+        return {'string': string, 'mime_type': mime_type}
+
+    html = FakeHTML(
+        base_url='weasyprint-custom:foo/', url_fetcher=fetcher, string='''
+      <link rel=stylesheet href=style.css>
+      <link rel=stylesheet href=unused.css media=screen>
+      <style>p { background: url(style.png) }</style>
+      <img src=img.png><object data=object.png></object>
+      <p style="list-style-image: url(attribute.png)">''')
+    pdf = html.write_pdf()
+    assert sorted(fetched) == sorted(resources)
+    fetched.clear()
+
+    # Resources are fetched in parallel, only once
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        assert html.write_pdf(executor=executor) == pdf
+    assert sorted(fetched) == sorted(resources)
+    fetched.clear()
+
+    # Resources are not prefetched by process pools, as the fetcher can't be
+    # pickled
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        assert html.write_pdf(executor=executor) == pdf
+    assert sorted(fetched) == sorted(resources)
+
+
 @assert_no_logs
 def test_html_meta():
     def assert_meta(html, **meta):
@@ -984,3 +1154,208 @@ def test_page_copy_relative():
     duplicated_pages = document.copy([*document.pages, *document.pages])
     pngs = duplicated_pages.write_png(split_images=True)
     assert pngs[0] == pngs[1]
+
+
+@assert_no_logs
+@pytest.mark.parametrize('style', (
+    '',
+    '@page { @top-center { content: counter(page) "/" counter(pages) } }',
+    'h2::after { content: target-counter("#p", page) }',
+    '@page { @top-center { content: target-counter("#p", page) } }',
+    '@page { @top-center { content: target-text("#p") } }',
+    'h1 { string-set: title counter(pages) }',
+    '@page { --pages: counter(pages); @top-center { content: var(--pages) } }',
+    'div { position: fixed; top: 0 }',
+    'h2::before { content: "x"; position: fixed; top: 0 }',
+))
+def test_render_pages(style):
+    html = FakeHTML(string=f'''
+      <style>
+        @page {{ size: 50px; @bottom-center {{ content: string(title) }} }}
+        h1, h2 {{ string-set: title content() }}
+        p {{ break-after: page }}
+        {style}
+      </style>
+      <div>a</div>
+      <h1>b</h1><p>c</p><h2>d</h2><p id="p">e</p><p>f</p>
+    ''')
+    document = html.render()
+    pages = html.render_pages()
+    first_page = next(pages)
+    pages = [first_page, *pages]
+    assert len(pages) == len(document.pages) == 3
+    for page, document_page in zip(pages, document.pages):
+        assert (page.width, page.height) == (
+            document_page.width, document_page.height)
+        assert page.bookmarks == document_page.bookmarks
+    assert document.copy(pages).write_png() == document.write_png()
+
+
+@assert_no_logs
+def test_renderer():
+    renderer = Renderer(stylesheets=[CSS(string='@page { size: 10px }')])
+    html = FakeHTML(
+        base_url=resource_filename('<inline HTML>'),
+        string='<img src=pattern.png style="hyphens: auto" lang=en>')
+    pdf_bytes = renderer.write_pdf(html)
+    assert pdf_bytes.startswith(b'%PDF')
+    image_cache = renderer.image_cache
+    assert len(image_cache) == 1
+
+    # Caches and fonts are shared between documents
+    font_config = renderer.font_config
+    document = renderer.render(html)
+    assert len(document.pages) == 1
+    assert renderer.image_cache is image_cache
+    assert len(image_cache) == 1
+    assert renderer.font_config is font_config
+
+    # Counter styles defined by documents are not shared
+    renderer.render(FakeHTML(
+        string='<style>@counter-style foo { symbols: a }</style>'))
+    assert 'foo' not in renderer.counter_style
+
+    # Caches can be emptied
+    renderer.clear()
+    assert not renderer.image_cache
+
+    # Least recently used images are removed when the cache is too large
+    renderer = Renderer(image_cache=ImageCache(max_size=0))
+    renderer.render(FakeHTML(
+        base_url=resource_filename('<inline HTML>'),
+        string='<img src=pattern.png><img src=blue.jpg>'))
+    assert len(renderer.image_cache) == 1
+    assert path2url(resource_filename('blue.jpg')) in renderer.image_cache
+
+    # Image caches given to renderers are not emptied
+    image_cache = renderer.image_cache
+    renderer = Renderer(image_cache=image_cache)
+    assert len(renderer.image_cache) == 1
+
+
+@assert_no_logs
+def test_renderer_font_face():
+    renderer = Renderer()
+    style = '<style>body { font-family: weasyprint }</style>'
+    font_face = (
+        '@font-face { src: url(weasyprint.otf); font-family: weasyprint }')
+    base_url = resource_filename('<inline HTML>')
+
+    def line_height(html):
+        page, = renderer.render(html).pages
+        html, = page._page_box.children
+        body, = html.children
+        line, = body.children
+        return line.height
+
+    # Cached strut layouts are measured with the fonts available when the
+    # document is rendered
+    html = FakeHTML(string=f'{style}<span>abc</span>', base_url=base_url)
+    default_height = line_height(html)
+    html = FakeHTML(
+        string=f'<style>{font_face}</style>{style}<span>abc</span>',
+        base_url=base_url)
+    font_height = line_height(html)
+    assert font_height != default_height
+
+    # Fonts declared by a document are available for the next documents
+    html = FakeHTML(string=f'{style}<span>abc</span>', base_url=base_url)
+    assert line_height(html) == font_height
+
+
+@assert_no_logs
+def test_renderer_font_face_min_content():
+    renderer = Renderer()
+    style = 'body { font-family: weasyprint; width: min-content }'
+    font_face = (
+        '@font-face { src: url(weasyprint.otf); font-family: weasyprint }')
+    base_url = resource_filename('<inline HTML>')
+
+    def body_width(html):
+        page, = renderer.render(html).pages
+        html, = page._page_box.children
+        body, = html.children
+        return body.width
+
+    # Cached min-content widths are measured with the fonts available when
+    # the document is rendered
+    html = FakeHTML(
+        string=f'<style>{style}</style><span>abc</span>', base_url=base_url)
+    assert body_width(html) != 3 * 16
+    html = FakeHTML(
+        string=f'<style>{font_face}{style}</style><span>abc</span>',
+        base_url=base_url)
+    assert body_width(html) == 3 * 16
+
+
+@assert_no_logs
+def test_image_cache():
+    cache = ImageCache(content_keys=True)
+    with open(resource_filename('pattern.png'), 'rb') as fd:
+        data = base64.b64encode(fd.read()).decode()
+    urls = f'data:image/png;base64,{data}', f'data:;base64,{data}'
+    html = FakeHTML(string=''.join(f'<img src="{url}">' for url in urls))
+    pdf_1 = html.write_pdf(image_cache=cache)
+    # Identical images are stored once
+    assert len(cache) == 1
+    image = cache[urls[0]]
+    assert cache[urls[1]] is image
+    assert 0 < cache.size <= cache.max_size
+    assert cache.size == image.memory_size
+
+    # Encoded images are reused by the next documents
+    assert image._x_objects
+    x_objects = dict(image._x_objects)
+    pdf_2 = html.write_pdf(image_cache=cache)
+    assert image._x_objects == x_objects
+    assert pdf_1 == pdf_2
+    assert cache.size == image.memory_size
+
+    # Images are removed with all their URLs
+    cache.max_size = 0
+    cache['other'] = None
+    assert len(cache) == 1
+    assert urls[0] not in cache and urls[1] not in cache
+    assert cache.size == 0
+
+
+@assert_no_logs
+def test_renderer_write_pdfs(tmpdir):
+    renderer = Renderer(stylesheets=[CSS(string='@page { size: 10px }')])
+    jobs = [
+        ({'string': f'<p>{i}'}, tmpdir.join(f'{i}.pdf').strpath)
+        for i in range(5)]
+    jobs.append(('missing.html', tmpdir.join('missing.pdf').strpath))
+    results = list(renderer.write_pdfs(jobs, processes=2))
+    assert [target for target, _ in results] == [
+        target for _, target in jobs]
+    for target, error in results[:-1]:
+        assert error is None
+        assert Path(target).read_bytes().startswith(b'%PDF')
+    assert isinstance(results[-1][1], FileNotFoundError)
+
+
+def _kill_worker(url):
+    os._exit(1)
+
+
+@pytest.mark.skipif(
+    'fork' not in multiprocessing.get_all_start_methods(),
+    reason='documents are rendered in the current process')
+@assert_no_logs
+def test_renderer_write_pdfs_killed_worker(tmpdir):
+    # Jobs killing their worker are reported, other jobs are rendered
+    renderer = Renderer()
+    jobs = [
+        ({'string': f'<p>{i}'}, tmpdir.join(f'{i}.pdf').strpath)
+        for i in range(4)]
+    jobs.insert(1, (
+        {'string': '<img src="http://example.invalid/a.png">',
+         'url_fetcher': _kill_worker},
+        tmpdir.join('killed.pdf').strpath))
+    results = list(renderer.write_pdfs(jobs, processes=2))
+    assert [target for target, _ in results] == [
+        target for _, target in jobs]
+    errors = [error for _, error in results]
+    assert isinstance(errors.pop(1), BrokenProcessPool)
+    assert errors == [None] * 4
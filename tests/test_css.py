@@ -6,15 +6,22 @@
 
 """
 
+from collections import OrderedDict
 from math import isclose
 
+import cssselect2
 import pytest
 import tinycss2
 from weasyprint import CSS, css, default_url_fetcher
 from weasyprint.css import (
-    PageType, get_all_computed_styles, parse_page_selectors)
+    PageType, computed_values, get_all_computed_styles, parse_page_selectors)
 from weasyprint.css.computed_values import strut_layout
+from weasyprint.css.counters import CounterStyle
+from weasyprint.css.selectors import (
+    Matcher, compile_selector_list, element_bits)
+from weasyprint.html import HTML5_PH, HTML5_UA, _load_ua_stylesheets
 from weasyprint.layout.page import set_page_type_computed_styles
+from weasyprint.text.fonts import FontConfiguration
 from weasyprint.urls import path2url
 
 from .testing_utils import (
@@ -45,6 +52,100 @@ def test_find_stylesheets():
     # TODO: test that the values are correct too
 
 
+@assert_no_logs
+def test_stylesheet_cache(monkeypatch):
+    monkeypatch.setattr(css, 'STYLESHEET_CACHE', OrderedDict())
+    html = FakeHTML(base_url=resource_filename('<inline HTML>'), string='''
+      <style>
+        @font-face { src: url(weasyprint.otf); font-family: weasyprint }
+        @counter-style foo { symbols: a }
+        @page { size: 10px }
+        p { color: red }
+        div { colour: red }
+      </style>''')
+    sheets = []
+    for _ in range(2):
+        font_config, counter_style, page_rules = (
+            FontConfiguration(), CounterStyle(), [])
+        with capture_logs() as logs:
+            sheet, = css.find_stylesheets(
+                html.wrapper_element, 'print', default_url_fetcher,
+                html.base_url, font_config, counter_style, page_rules)
+        # Side effects and messages are the same for cached stylesheets
+        assert len(logs) == 1
+        assert 'colour' in logs[0]
+        assert 'foo' in counter_style
+        assert len(page_rules) == 1
+        assert len(sheet.fonts) == 1
+        sheets.append(sheet)
+    assert len(css.STYLESHEET_CACHE) == 1
+    assert sheets[0].matcher is sheets[1].matcher
+
+
+@assert_no_logs
+def test_ua_stylesheets_cache(tmp_path, monkeypatch):
+    monkeypatch.delenv('WEASYPRINT_CACHE_DIR', raising=False)
+    _load_ua_stylesheets(HTML5_UA, HTML5_PH)
+    assert not list(tmp_path.iterdir())
+
+    monkeypatch.setenv('WEASYPRINT_CACHE_DIR', str(tmp_path / 'cache'))
+    (tmp_path / 'cache').mkdir()
+    (tmp_path / 'cache' / 'ua-other.pickle').write_bytes(b'')
+    stylesheets = _load_ua_stylesheets(HTML5_UA, HTML5_PH)
+    assert len(list((tmp_path / 'cache').iterdir())) == 2
+    cached_stylesheets = _load_ua_stylesheets(HTML5_UA, HTML5_PH)
+    assert cached_stylesheets[0] == stylesheets[0]
+
+    def matches(sheet, element):
+        return [
+            (specificity, order, pseudo, [
+                (name, importance) for name, _, importance in declarations])
+            for specificity, order, pseudo, declarations
+            in sheet.matcher.match(element)]
+
+    document = FakeHTML(string='<h1>a</h1><ul><li>b</ul><p dir=rtl>c</p>')
+    for element in document.wrapper_element.iter_subtree():
+        for sheet, cached_sheet in zip(
+                stylesheets[1:], cached_stylesheets[1:]):
+            assert matches(sheet, element) == matches(cached_sheet, element)
+            assert len(sheet.page_rules) == len(cached_sheet.page_rules)
+
+
+@assert_no_logs
+def test_selector_matcher():
+    selectors = (
+        'div p', 'body > div', '.c span', '#a li + li', 'ul ~ *', '[href]',
+        '*[lang]', '[dir=rtl] a', 'section a:first-child', 'p b ~ i',
+        '.x .d', 'div .d:nth-child(2)', ':not(div) span', 'a[name]',
+        'html p > span', 'div > ul > li.d', 'section > p > a + b')
+    matcher, reference_matcher = Matcher(), cssselect2.Matcher()
+    for i, selector in enumerate(selectors):
+        tokens = tinycss2.parse_component_value_list(selector)
+        for compiled_selector in compile_selector_list(tokens):
+            matcher.add_selector(compiled_selector, i)
+        for compiled_selector in cssselect2.compile_selector_list(tokens):
+            reference_matcher.add_selector(compiled_selector, i)
+
+    document = FakeHTML(string='''
+      <body class=x>
+        <div id=a class="c d">
+          <p lang=fr>t<span title=z>s</span></p>
+          <ul><li>1<li class=d>2<li>3</ul>
+        </div>
+        <section><p dir=rtl><a href=x name=y>l</a><b>b</b><i>i</i></p>
+      </body>''')
+    ancestor_filters = {}
+    for element in document.wrapper_element.iter_subtree():
+        ancestor_bits = (
+            0 if element.parent is None
+            else ancestor_filters[element.parent.etree_element])
+        ancestor_filters[element.etree_element] = (
+            ancestor_bits | element_bits(element))
+        reference = reference_matcher.match(element)
+        assert matcher.match(element) == reference
+        assert matcher.match(element, ancestor_bits) == reference
+
+
 @assert_no_logs
 def test_expand_shorthands():
     sheet = CSS(resource_filename('sheet2.css'))
@@ -156,6 +257,39 @@ def test_annotate_document():
     # and inheritance are correct…
 
 
+@assert_no_logs
+def test_style_sharing():
+    document = FakeHTML(string='''
+      <style>td { color: red } td:first-child { color: blue }</style>
+      <table>
+        <tr><td>a</td><td>b</td><td>c</td></tr>
+        <tr><td>d</td><td>e</td><td id=f>f</td></tr>
+      </table>''')
+    style_for = get_all_computed_styles(document)
+    styles = [style_for(cell) for cell in document.etree_element.iter('td')]
+    shared = [style.shared_style for style in styles]
+    assert None not in shared
+    assert shared[0] is shared[3]
+    assert shared[1] is shared[2] is shared[4]
+    assert shared[0] is not shared[1]
+    # Attributes can change computed values
+    assert shared[5] is not shared[4]
+    assert [style['color'] for style in styles] == [
+        (0, 0, 1, 1), (1, 0, 0, 1), (1, 0, 0, 1),
+        (0, 0, 1, 1), (1, 0, 0, 1), (1, 0, 0, 1)]
+    assert styles[5]['anchor'] == 'f'
+
+    # Shared values are not stored in each style
+    assert styles[2]['display'] == ('table-cell',)
+    assert 'color' not in styles[2] and 'display' not in styles[2]
+    assert styles[2].specified is shared[2].specified
+    assert not hasattr(styles[2], '__dict__')
+
+    # Elements sharing values can still be modified independently
+    styles[1]['color'] = (0, 1, 0, 1)
+    assert styles[2]['color'] == (1, 0, 0, 1)
+
+
 @assert_no_logs
 def test_page():
     document = FakeHTML(resource_filename('doc1.html'))
@@ -228,6 +362,30 @@ def test_page():
     assert style['font_size'] == 10
 
 
+@assert_no_logs
+def test_page_style_sharing():
+    document = FakeHTML(string='<p>a</p>')
+    style_for = get_all_computed_styles(document, user_stylesheets=[CSS(
+        string='@page { margin: 10px } @page :nth(2n) { @top-left { '
+        'content: "a" } }')])
+
+    page_types = [
+        PageType(side='left', first=False, blank=False, index=index, name='')
+        for index in range(4)]
+    for page_type in page_types:
+        set_page_type_computed_styles(page_type, document, style_for)
+    styles = [style_for(page_type) for page_type in page_types]
+    assert [style['margin_top'] for style in styles] == 4 * [(10, 'px')]
+    assert styles[0].shared_style is styles[2].shared_style
+    assert styles[1].shared_style is styles[3].shared_style
+    assert styles[0].shared_style is not styles[1].shared_style
+
+    styles = [style_for(page_type, '@top-left') for page_type in page_types]
+    assert styles[0] is styles[2] is None
+    assert styles[1].shared_style is styles[3].shared_style
+    assert styles[3]['content'] == (('string', 'a'),)
+
+
 @assert_no_logs
 @pytest.mark.parametrize('style, selectors', (
     ('@page {}', [{
@@ -482,6 +640,29 @@ def test_font_size(parent_css, parent_size, child_css, child_size):
     assert isclose(style_for(span)['font_size'], child_size)
 
 
+@assert_no_logs
+def test_computed_lengths_cache(monkeypatch):
+    monkeypatch.setattr(computed_values, 'COMPUTED_LENGTHS', {})
+    monkeypatch.setattr(
+        computed_values, 'COMPUTED_LENGTHS_STATS', {'hits': 0, 'misses': 0})
+    document = FakeHTML(string='<p>a<span>b</span><span>c</span>')
+    style_for = get_all_computed_styles(document, user_stylesheets=[CSS(
+        string='p { font-size: 20px } span { margin: 1em 2pt; padding: 1em }'
+    )])
+
+    _head, body = document.etree_element
+    p, = body
+    span1, span2 = p
+    span1, span2 = style_for(span1), style_for(span2)
+    assert span1['margin_top'] == span1['padding_top'] == (20, 'px')
+    assert span1['margin_left'] == (8 / 3, 'px')
+    assert computed_values.COMPUTED_LENGTHS_STATS == {'hits': 1, 'misses': 2}
+    # Computed values are shared
+    assert span2['padding_bottom'] is span1['margin_top']
+    assert span2['margin_right'] is span1['margin_left']
+    assert computed_values.COMPUTED_LENGTHS_STATS == {'hits': 3, 'misses': 2}
+
+
 @pytest.mark.parametrize('media, width, warning', (
     ('@media screen { @page { size: 10px } }', 20, False),
     ('@media print { @page { size: 10px } }', 10, False),
@@ -6,7 +6,9 @@
 
 """
 
-from .testing_utils import assert_no_logs, render_pages
+from weasyprint.text.fonts import FontConfiguration
+
+from .testing_utils import BASE_URL, FakeHTML, assert_no_logs, render_pages
 
 
 @assert_no_logs
@@ -175,3 +177,17 @@ def test_woff_simple():
     assert span1.width == span3.width
     # the default font does not match the loaded fonts
     assert span1.width != span4.width
+
+
+@assert_no_logs
+def test_pango_objects_pool():
+    font_config = FontConfiguration()
+    html = FakeHTML(base_url=BASE_URL, string='''
+      <style>
+        @font-face { src: url(weasyprint.otf); font-family: weasyprint }
+        p { font-family: weasyprint; text-decoration: underline }
+      </style>
+      <p>abc</p><p lang="fr">def</p><p lang="fr">ghi</p>''')
+    html.render(font_config=font_config)
+    assert set(font_config.pango_contexts) == {None, 'fr'}
+    assert {lang for lang, _ in font_config.font_metrics} == {None, 'fr'}
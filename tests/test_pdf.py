@@ -10,12 +10,16 @@ import hashlib
 import io
 import os
 import re
+import struct
 from codecs import BOM_UTF16_BE
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import pytest
+from fontTools import subset
+from PIL import Image, features
 from weasyprint import Attachment
 from weasyprint.document import Document, DocumentMetadata
-from weasyprint.text.fonts import FontConfiguration
+from weasyprint.text.fonts import FontConfiguration, FontSubsetCache
 from weasyprint.urls import path2url
 
 from .testing_utils import (
@@ -494,6 +498,60 @@ def test_embed_jpeg():
         string='<img src="blue.jpg">').write_pdf()
 
 
+@assert_no_logs
+def test_embed_jpeg_passthrough():
+    # Original JPEG file is included without being encoded again
+    with open(resource_filename('blue.jpg'), 'rb') as fd:
+        jpeg = fd.read()
+    html = FakeHTML(
+        base_url=resource_filename('dummy.html'),
+        string='<img src="blue.jpg">')
+    assert jpeg in html.write_pdf()
+    assert jpeg not in html.write_pdf(optimize_size=('images',))
+
+
+@assert_no_logs
+@pytest.mark.skipif(
+    not features.check('jpg_2000'), reason='JPEG 2000 is not supported')
+def test_embed_jpeg2000(tmpdir):
+    jpeg2000 = io.BytesIO()
+    Image.new('RGB', (4, 4), 'blue').save(jpeg2000, format='JPEG2000')
+    jpeg2000 = jpeg2000.getvalue()
+    tmpdir.join('blue.jp2').write_binary(jpeg2000)
+    pdf = FakeHTML(
+        base_url=str(tmpdir.join('dummy.html')),
+        string='<img src="blue.jp2">').write_pdf()
+    assert b'/Filter /JPXDecode' in pdf
+    assert jpeg2000 in pdf
+
+
+@assert_no_logs
+@pytest.mark.parametrize('mode, passthrough', (
+    ('RGB', True),
+    ('L', True),
+    ('RGBA', False),
+    ('P', False),
+))
+def test_embed_png_passthrough(tmpdir, mode, passthrough):
+    # Original PNG data is included for 8-bit RGB and grayscale images
+    png = io.BytesIO()
+    image = Image.new('RGB', (10, 10), (255, 0, 0)).convert(mode)
+    image.save(png, format='PNG', compress_level=1)
+    tmpdir.join('red.png').write_binary(png.getvalue())
+    png.seek(8)
+    while True:
+        chunk_length, = struct.unpack('!I', png.read(4))
+        chunk_type, chunk = png.read(4), png.read(chunk_length)
+        png.read(4)  # CRC
+        if chunk_type == b'IDAT':
+            idat = chunk
+            break
+    pdf = FakeHTML(
+        base_url=str(tmpdir.join('dummy.html')),
+        string='<img src="red.png">').write_pdf()
+    assert (idat in pdf) is passthrough
+
+
 @assert_no_logs
 def test_embed_image_once():
     # Image repeated multiple times, embedded once
@@ -671,3 +729,128 @@ def test_bleed(style, media, bleed, trim):
     assert '/MediaBox [ {} {} {} {} ]'.format(*media).encode() in pdf
     assert '/BleedBox [ {} {} {} {} ]'.format(*bleed).encode() in pdf
     assert '/TrimBox [ {} {} {} {} ]'.format(*trim).encode() in pdf
+
+
+@assert_no_logs
+def test_write_pages_incrementally():
+    class Target(io.BytesIO):
+        def write(self, data):
+            # Store the size of the written PDF when the first font is written
+            if b'/FontFile' in data and not hasattr(self, 'font_position'):
+                self.font_position = self.tell()
+            return super().write(data)
+
+    document = FakeHTML(
+        base_url=resource_filename('dummy.html'),
+        string='''
+          <p style="break-after: page">a</p>
+          <img src="blue.jpg" style="break-after: page">
+          <p>b</p>
+        ''').render()
+    target = Target()
+    document.write_pdf(target)
+    pdf = target.getvalue()
+    assert pdf == document.write_pdf()
+    assert pdf.count(b'/Type /Page\n') == 3
+    assert pdf.count(b'/Filter /DCTDecode') == 1
+
+    # Pages and images are written before fonts
+    assert pdf.rindex(b'/Type /Page\n') < target.font_position
+    assert pdf.index(b'/Filter /DCTDecode') < target.font_position
+
+    # Finishers can change all the objects
+    def finisher(document, pdf):
+        pdf.catalog['PageMode'] = '/UseOutlines'
+
+    pdf = document.write_pdf(finisher=finisher)
+    assert b'/PageMode /UseOutlines' in pdf
+
+
+@assert_no_logs
+def test_write_pages_unsupported_pydyf(monkeypatch):
+    document = FakeHTML(string='<p>a</p>').render()
+    pdf = document.write_pdf()
+
+    # With unsupported pydyf versions, the whole PDF is written by pydyf
+    def writer(pdf, output):
+        raise AssertionError('PDF written incrementally')
+
+    monkeypatch.setattr('weasyprint.document.PYDYF_STREAMING', False)
+    monkeypatch.setattr('weasyprint.document.PDFWriter', writer)
+    unstreamed_pdf = document.write_pdf()
+    assert unstreamed_pdf.split(b'\n')[:2] == pdf.split(b'\n')[:2]
+    assert unstreamed_pdf.count(b'/Type /Page\n') == 1
+
+
+@assert_no_logs
+def test_font_cache(tmpdir, monkeypatch):
+    font_cache = FontSubsetCache(tmpdir.join('fonts'))
+    html = FakeHTML(
+        base_url=resource_filename('dummy.html'),
+        string='''
+          <style>
+            @font-face { src: url(weasyprint.otf); font-family: weasyprint }
+            body { font-family: weasyprint }
+          </style>
+          <p>abc</p>''')
+    pdf = html.write_pdf(font_cache=font_cache)
+    assert tmpdir.join('fonts').listdir()
+
+    # Cached fonts are not subsetted again
+    def subsetter(options):
+        raise AssertionError('Font has been subsetted')
+    monkeypatch.setattr(subset, 'Subsetter', subsetter)
+    assert html.write_pdf(font_cache=font_cache) == pdf
+
+
+def test_font_cache_eviction(tmpdir):
+    font_cache = FontSubsetCache(tmpdir, max_size=25)
+    for i, key in enumerate(('a', 'b', 'c')):
+        font_cache.set(key, b'0123456789')
+        os.utime(tmpdir.join(key), (i, i))
+    assert font_cache.get('a') is None
+    assert font_cache.get('b') == font_cache.get('c') == b'0123456789'
+    font_cache.set('d', b'0123456789')
+    assert font_cache.get('b') is None
+    assert font_cache.get('c') == font_cache.get('d') == b'0123456789'
+
+
+@assert_no_logs
+def test_executor():
+    document = FakeHTML(
+        base_url=resource_filename('dummy.html'),
+        string='''
+          <style>
+            @font-face { src: url(weasyprint.otf); font-family: weasyprint }
+            p { font-family: weasyprint; background: url(pattern.gif) }
+          </style>
+          <p>abc</p>
+          <img src="blue.jpg"><img src="pattern.png"><img src="icon.png">
+          <p style="break-before: page">def <img src="blue.jpg"></p>
+        ''').render()
+
+    def finisher(document, pdf):
+        pass
+
+    pdf = document.write_pdf()
+    finished_pdf = document.write_pdf(finisher=finisher)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert document.write_pdf(executor=executor) == pdf
+        assert document.write_pdf(
+            finisher=finisher, executor=executor) == finished_pdf
+
+
+@assert_no_logs
+def test_process_executor_image_cache():
+    # Images encoded in other processes are kept in the image cache
+    cache = {}
+    html = FakeHTML(
+        base_url=resource_filename('dummy.html'),
+        string='<img src="pattern.png">')
+    pdf = html.render(image_cache=cache).write_pdf()
+    image, = cache.values()
+    image._x_objects.clear()
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        assert html.render(image_cache=cache).write_pdf(
+            executor=executor) == pdf
+    assert image.has_x_object('true')
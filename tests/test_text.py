@@ -8,7 +8,8 @@
 
 import pytest
 from weasyprint.css.properties import INITIAL_VALUES
-from weasyprint.text.line_break import split_first_line
+from weasyprint.text.line_break import (
+    TEXT_MEASURES_STATS, min_content_line_widths, split_first_line)
 
 from .testing_utils import MONO_FONTS, SANS_FONTS, assert_no_logs, render_pages
 
@@ -57,6 +58,74 @@ def test_line_breaking():
     assert string.encode()[resume_index:].decode() == 'text for test'
 
 
+@assert_no_logs
+def test_line_breaking_long_text():
+    # The first line of long texts is found without shaping the whole text
+    string = 'i ' * 5000
+    _, length, resume_index, width, _, _ = make_text(
+        string, 100, font_family=SANS_FONTS.split(','), font_size=10)
+    _, short_length, short_resume_index, short_width, _, _ = make_text(
+        string[:200], 100, font_family=SANS_FONTS.split(','), font_size=10)
+    assert (length, resume_index) == (short_length, short_resume_index)
+    assert width == short_width <= 100
+
+
+@assert_no_logs
+@pytest.mark.parametrize('text', (
+    'This is a text for test',
+    ' leading and  collapsed  spaces ',
+    'hyphen-separated words, and/or slashes',
+))
+def test_min_content_line_widths(text):
+    # Widths are the same as the ones given by split_first_line at each break
+    style = dict(INITIAL_VALUES)
+    style['font_family'] = SANS_FONTS.split(',')
+    style['font_size'] = 19
+    widths = []
+    resume_index = new_resume_index = 0
+    while new_resume_index is not None:
+        resume_index += new_resume_index
+        _, _, new_resume_index, width, _, _ = split_first_line(
+            text[resume_index:], style, context=None, max_width=0,
+            justification_spacing=0, minimum=True)
+        widths.append(width)
+    assert min_content_line_widths(text, style, context=None) == widths
+
+
+@assert_no_logs
+def test_min_content_line_widths_hyphens():
+    style = dict(INITIAL_VALUES)
+    style['hyphens'] = 'auto'
+    assert min_content_line_widths('some text', style, context=None) is None
+
+
+@assert_no_logs
+def test_glyph_runs():
+    # Glyphs are kept after layout to draw text without shaping it again
+    layout, _, _, _, _, _ = make_text('some text')
+    assert layout.glyph_runs
+    assert sum(run.length for run in layout.glyph_runs) == len('some text')
+    layout, _, _, _, _, _ = make_text('some text', 45)
+    assert sum(run.length for run in layout.glyph_runs) == len('some')
+
+
+@assert_no_logs
+def test_text_measures_cache():
+    # Texts fitting in one line are measured once
+    hits = TEXT_MEASURES_STATS['hits']
+    page, = render_pages('''
+      <style>p { width: 200px }</style>
+      <p>Total</p><p>Total</p><p><span>Total</span></p>''')
+    assert TEXT_MEASURES_STATS['hits'] > hits
+    html, = page.children
+    body, = html.children
+    widths = set()
+    for paragraph in body.children:
+        line, = paragraph.children
+        widths.add(line.width)
+    assert len(widths) == 1
+
+
 @assert_no_logs
 def test_line_breaking_rtl():
     string = 'لوريم ايبسوم دولا'
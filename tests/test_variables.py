@@ -85,6 +85,65 @@ def test_variable_chain():
     assert paragraph.width == 10
 
 
+def test_variable_chain_resolved():
+    page, = parse('''
+      <style>
+        html { --foo: 10px; --var: var(--foo) }
+        p { --foo: 20px; width: var(--var) }
+      </style>
+      <p></p>
+    ''')
+    html, = page.children
+    body, = html.children
+    paragraph, = body.children
+    assert paragraph.width == 10
+
+
+def test_variable_cycle():
+    page, = parse('''
+      <style>
+        p { --foo: var(--bar); --bar: var(--foo); width: var(--foo, 10px) }
+      </style>
+      <p></p>
+    ''')
+    html, = page.children
+    body, = html.children
+    paragraph, = body.children
+    assert paragraph.width == 10
+
+
+def test_variable_cycle_default():
+    # All the properties of a cycle are invalid, even with default values,
+    # whatever the property resolved first is
+    page, = parse('''
+      <style>
+        div { --foo: var(--bar, 10px); --bar: var(--foo) }
+        .foo { width: var(--foo, 30px) }
+        .bar { width: var(--bar, 30px) }
+        .baz { --baz: var(--foo, 20px); width: var(--baz) }
+      </style>
+      <div class="foo"></div><div class="bar"></div><div class="baz"></div>
+    ''')
+    html, = page.children
+    body, = html.children
+    foo, bar, baz = body.children
+    assert foo.width == bar.width == 30
+    assert baz.width == 20
+
+
+def test_variable_default():
+    page, = parse('''
+      <style>
+        p { width: var(--var, 10px) }
+      </style>
+      <p></p>
+    ''')
+    html, = page.children
+    body, = html.children
+    paragraph, = body.children
+    assert paragraph.width == 10
+
+
 def test_variable_partial_1():
     page, = parse('''
       <style>
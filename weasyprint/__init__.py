@@ -9,14 +9,13 @@ import contextlib
 from pathlib import Path
 
 import cssselect2
-import html5lib
 import tinycss2
 
 VERSION = __version__ = '54.1'
 
 __all__ = [
-    'HTML', 'CSS', 'Attachment', 'Document', 'Page', 'default_url_fetcher',
-    'VERSION', '__version__']
+    'HTML', 'CSS', 'Attachment', 'Document', 'Page', 'Renderer',
+    'default_url_fetcher', 'VERSION', '__version__']
 
 
 # Import after setting the version, as the version is used in other modules
@@ -28,7 +27,7 @@ from .logger import LOGGER, PROGRESS_LOGGER  # noqa isort:skip
 
 
 class HTML:
-    """HTML document parsed by html5lib.
+    """HTML document parsed by html5lib or by another HTML parser.
 
     You can just create an instance with a positional argument:
     ``doc = HTML(something)``
@@ -44,6 +43,10 @@ class HTML:
     :type file_obj: :term:`file object`
     :param file_obj: Any object with a ``read`` method.
     :param str string: A string of HTML source.
+    :type tree: :class:`xml.etree.ElementTree.Element`
+    :param tree: The root element of an already parsed HTML tree, or an
+        :class:`xml.etree.ElementTree.ElementTree`. HTML elements must not be
+        in the XHTML namespace. The tree is used as is, without being copied.
 
     Specifying multiple inputs is an error:
     ``HTML(filename="foo.html", url="localhost://bar.html")``
@@ -65,25 +68,35 @@ class HTML:
         Defaults to ``'print'``. **Note:** In some cases like
         ``HTML(string=foo)`` relative URLs will be invalid if ``base_url``
         is not provided.
+    :type parser: :term:`function`
+    :param parser: A function called to parse the HTML source, with the same
+        signature as :func:`html.parse_html5lib`. Defaults to
+        :func:`html.parse_html5lib`. :func:`html.parse_html5_parser` is much
+        faster, but requires html5-parser to be installed.
 
     """
     def __init__(self, guess=None, filename=None, url=None, file_obj=None,
                  string=None, encoding=None, base_url=None,
-                 url_fetcher=default_url_fetcher, media_type='print'):
+                 url_fetcher=default_url_fetcher, media_type='print',
+                 parser=None, tree=None):
         PROGRESS_LOGGER.info(
             'Step 1 - Fetching and parsing HTML - %s',
             guess or filename or url or
-            getattr(file_obj, 'name', 'HTML string'))
+            ('HTML tree' if tree is not None else
+             getattr(file_obj, 'name', 'HTML string')))
         result = _select_source(
-            guess, filename, url, file_obj, string, base_url, url_fetcher)
+            guess, filename, url, file_obj, string, base_url, url_fetcher,
+            tree=tree)
+        if parser is None:
+            parser = parse_html5lib
         with result as (source_type, source, base_url, protocol_encoding):
-            if isinstance(source, str):
-                result = html5lib.parse(source, namespaceHTMLElements=False)
+            if source_type == 'tree':
+                # Already parsed tree, ElementTree objects are accepted too
+                result = source
+                if hasattr(result, 'getroot'):
+                    result = result.getroot()
             else:
-                result = html5lib.parse(
-                    source, override_encoding=encoding,
-                    transport_encoding=protocol_encoding,
-                    namespaceHTMLElements=False)
+                result = parser(source, encoding, protocol_encoding)
         self.base_url = find_base_url(result, base_url)
         self.url_fetcher = url_fetcher
         self.media_type = media_type
@@ -102,7 +115,7 @@ class HTML:
 
     def render(self, stylesheets=None, presentational_hints=False,
                optimize_size=('fonts',), font_config=None, counter_style=None,
-               image_cache=None):
+               image_cache=None, executor=None):
         """Lay out and paginate the document, but do not (yet) export it.
 
         This returns a :class:`document.Document` object which provides
@@ -123,18 +136,51 @@ class HTML:
         :param font_config: A font configuration handling ``@font-face`` rules.
         :type counter_style: :class:`css.counters.CounterStyle`
         :param counter_style: A dictionary storing ``@counter-style`` rules.
-        :param dict image_cache: A dictionary used to cache images.
+        :param image_cache:
+            A dictionary or an :class:`images.ImageCache` used to cache images.
+        :type executor: :class:`concurrent.futures.Executor`
+        :param executor:
+            An executor used to fetch external resources in parallel, when it
+            is a :class:`concurrent.futures.ThreadPoolExecutor`.
         :returns: A :class:`document.Document` object.
 
         """
         return Document._render(
-            self, stylesheets, presentational_hints,
-            optimize_size, font_config, counter_style, image_cache)
+            self, stylesheets, presentational_hints, optimize_size,
+            font_config, counter_style, image_cache, executor=executor)
+
+    def render_pages(self, stylesheets=None, presentational_hints=False,
+                     optimize_size=('fonts',), font_config=None,
+                     counter_style=None, image_cache=None, executor=None):
+        """Lay out and paginate the document, yield pages one by one.
+
+        This is the streaming version of :meth:`render`: each page is laid out
+        when the next :class:`document.Page` object is requested, and pages
+        that are not referenced anymore can be released before the end of the
+        document's layout.
+
+        Pages depending on following pages can't be yielded before the whole
+        document is laid out. This happens when the document includes fixed
+        boxes, page-based counters in its content, ``target-*()`` functions,
+        or ``counter(pages)`` in page margins. In this case, all the pages are
+        laid out before the first one is yielded.
+
+        The arguments are the same as :meth:`render`. As fonts may be removed
+        when ``font_config`` is garbage-collected, pages must be used before
+        the end of the iteration, or with a ``font_config`` kept alive.
+
+        :returns: A generator of :class:`document.Page` objects.
+
+        """
+        return Document._render_pages(
+            self, stylesheets, presentational_hints, optimize_size,
+            font_config, counter_style, image_cache, executor=executor)
 
     def write_pdf(self, target=None, stylesheets=None, zoom=1,
                   attachments=None, finisher=None, presentational_hints=False,
                   optimize_size=('fonts',), font_config=None,
-                  counter_style=None, image_cache=None):
+                  counter_style=None, image_cache=None, font_cache=None,
+                  executor=None):
         """Render the document to a PDF file.
 
         This is a shortcut for calling :meth:`render`, then
@@ -168,7 +214,15 @@ class HTML:
         :param font_config: A font configuration handling ``@font-face`` rules.
         :type counter_style: :class:`css.counters.CounterStyle`
         :param counter_style: A dictionary storing ``@counter-style`` rules.
-        :param dict image_cache: A dictionary used to cache images.
+        :param image_cache:
+            A dictionary or an :class:`images.ImageCache` used to cache images.
+        :type font_cache: :class:`text.fonts.FontSubsetCache`
+        :param font_cache: A cache storing subsetted fonts between documents.
+        :type executor: :class:`concurrent.futures.Executor`
+        :param executor:
+            An executor used to subset fonts and encode images in parallel.
+            External resources are also fetched in parallel when it is a
+            :class:`concurrent.futures.ThreadPoolExecutor`.
         :returns:
             The PDF as :obj:`bytes` if ``target`` is not provided or
             :obj:`None`, otherwise :obj:`None` (the PDF is written to
@@ -179,8 +233,10 @@ class HTML:
             self.render(
                 stylesheets, presentational_hints=presentational_hints,
                 optimize_size=optimize_size, font_config=font_config,
-                counter_style=counter_style, image_cache=image_cache)
-            .write_pdf(target, zoom, attachments, finisher))
+                counter_style=counter_style, image_cache=image_cache,
+                executor=executor)
+            .write_pdf(
+                target, zoom, attachments, finisher, font_cache, executor))
 
 
 class CSS:
@@ -221,7 +277,7 @@ class CSS:
                     source, environment_encoding=encoding,
                     protocol_encoding=protocol_encoding)
         self.base_url = base_url
-        self.matcher = matcher or cssselect2.Matcher()
+        self.matcher = matcher or Matcher()
         self.page_rules = [] if page_rules is None else page_rules
         self.fonts = []
         preprocess_stylesheet(
@@ -255,16 +311,16 @@ class Attachment:
 @contextlib.contextmanager
 def _select_source(guess=None, filename=None, url=None, file_obj=None,
                    string=None, base_url=None, url_fetcher=default_url_fetcher,
-                   check_css_mime_type=False):
+                   check_css_mime_type=False, tree=None):
     """If only one input is given, return it with normalized ``base_url``."""
     if base_url is not None:
         base_url = ensure_url(base_url)
 
     selected_params = [
-        param for param in (guess, filename, url, file_obj, string) if
+        param for param in (guess, filename, url, file_obj, string, tree) if
         param is not None]
     if len(selected_params) != 1:
-        source = ', '.join(selected_params) or 'nothing'
+        source = ', '.join(map(str, selected_params)) or 'nothing'
         raise TypeError(f'Expected exactly one source, got {source}')
     elif guess is not None:
         if hasattr(guess, 'read'):
@@ -311,13 +367,16 @@ def _select_source(guess=None, filename=None, url=None, file_obj=None,
             if name and not name.startswith('<'):
                 base_url = ensure_url(name)
         yield 'file_obj', file_obj, base_url, None
+    elif tree is not None:
+        yield 'tree', tree, base_url, None
     else:
         assert string is not None
         yield 'string', string, base_url, None
 
 # Work around circular imports.
-from .css import preprocess_stylesheet  # noqa isort:skip
+from .css import Matcher, preprocess_stylesheet  # noqa isort:skip
 from .html import (  # noqa isort:skip
     HTML5_UA_COUNTER_STYLE, HTML5_UA_STYLESHEET, HTML5_PH_STYLESHEET,
-    find_base_url)
+    find_base_url, parse_html5lib)
 from .document import Document, Page  # noqa isort:skip
+from .renderer import Renderer  # noqa isort:skip
@@ -2,12 +2,15 @@
 
 import argparse
 import logging
+import os
 import platform
 import sys
+from pathlib import Path
+from urllib.parse import urlsplit
 
 import pydyf
 
-from . import HTML, LOGGER, __version__
+from . import HTML, LOGGER, Renderer, __version__
 from .text.ffi import pango
 
 
@@ -36,6 +39,13 @@ def main(argv=None, stdout=None, stdin=None):
     The input is a filename or URL to an HTML document, or ``-`` to read
     HTML from stdin. The output is a filename, or ``-`` to write to stdout.
 
+    Multiple inputs can be given. The output is then a directory where a PDF
+    file is generated for each input, named after the input's filename:
+
+    .. code-block:: sh
+
+        weasyprint [options] <input> <input> [<input> …] <output>
+
     Options can be mixed anywhere before, between, or after the input and
     output.
 
@@ -77,6 +87,21 @@ def main(argv=None, stdout=None, stdin=None):
         multiple times, ``all`` adds all allowed values, ``none`` removes all
         previously set values.
 
+    .. option:: -j <number>, --jobs <number>
+
+        Number of processes rendering documents in parallel when multiple
+        inputs are given. Defaults to the number of CPUs.
+
+    .. option:: --timeout <seconds>
+
+        Maximum time allowed to render each document. Only allowed when
+        multiple inputs are given.
+
+    .. option:: --memory-limit <megabytes>
+
+        Maximum memory used by each rendering process. Only allowed when
+        multiple inputs are given.
+
     .. option:: -v, --verbose
 
         Show warnings and information messages.
@@ -125,6 +150,15 @@ def main(argv=None, stdout=None, stdin=None):
                         help='Optimize output size for specified features.',
                         choices=('images', 'fonts', 'all', 'none'),
                         default=['fonts'])
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='Number of processes used to render multiple '
+                             'inputs, defaults to the number of CPUs.')
+    parser.add_argument('--timeout', type=float,
+                        help='Maximum time in seconds allowed to render each '
+                             'input, only with multiple inputs.')
+    parser.add_argument('--memory-limit', type=int,
+                        help='Maximum memory in megabytes used by each '
+                             'process, only with multiple inputs.')
     parser.add_argument('-v', '--verbose', action='store_true',
                         help='Show warnings and information messages.')
     parser.add_argument('-d', '--debug', action='store_true',
@@ -132,20 +166,36 @@ def main(argv=None, stdout=None, stdin=None):
     parser.add_argument('-q', '--quiet', action='store_true',
                         help='Hide logging messages.')
     parser.add_argument(
-        'input', help='URL or filename of the HTML input, or - for stdin')
+        'input', nargs='+',
+        help='URL or filename of the HTML input, or - for stdin. '
+             'May be given multiple times.')
     parser.add_argument(
-        'output', help='Filename where output is written, or - for stdout')
+        'output', help='Filename where output is written, or - for stdout. '
+                       'Directory where outputs are written if multiple '
+                       'inputs are given, a suffix is added to the names of '
+                       'inputs with the same name.')
 
     args = parser.parse_args(argv)
 
-    if args.input == '-':
+    if len(args.input) > 1:
+        if '-' in args.input or args.output == '-':
+            parser.error(
+                'stdin and stdout are not allowed with multiple inputs')
+        if not os.path.isdir(args.output):
+            parser.error('output must be a directory with multiple inputs')
+    elif args.timeout is not None or args.memory_limit is not None:
+        # The only input is rendered in the current process
+        parser.error(
+            '--timeout and --memory-limit are only allowed with multiple '
+            'inputs')
+    elif args.input[0] == '-':
         source = stdin or sys.stdin.buffer
         if args.base_url is None:
             args.base_url = '.'  # current directory
         elif args.base_url == '':
             args.base_url = None  # no base URL
     else:
-        source = args.input
+        source = args.input[0]
 
     if args.output == '-':
         output = stdout or sys.stdout.buffer
@@ -177,6 +227,34 @@ def main(argv=None, stdout=None, stdin=None):
         handler.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
         LOGGER.addHandler(handler)
 
+    if len(args.input) > 1:
+        renderer = Renderer(
+            stylesheets=args.stylesheet,
+            presentational_hints=args.presentational_hints,
+            optimize_size=tuple(optimize_size), media_type=args.media_type)
+        jobs = []
+        names = set()
+        for source in args.input:
+            stem = name = Path(urlsplit(source).path).stem or 'index'
+            # Don't overwrite outputs of inputs with the same name
+            index = 1
+            while name in names:
+                index += 1
+                name = f'{stem}-{index}'
+            names.add(name)
+            html_kwargs = {
+                'guess': source, 'base_url': args.base_url,
+                'encoding': args.encoding, 'media_type': args.media_type}
+            jobs.append(
+                (html_kwargs, os.path.join(output, f'{name}.pdf')))
+        memory_limit = args.memory_limit and args.memory_limit * 1024 ** 2
+        for target, error in renderer.write_pdfs(
+                jobs, args.jobs, args.timeout, memory_limit,
+                args.attachment):
+            if error is not None:
+                LOGGER.error('Failed to render %s: %s', target, error)
+        return
+
     html = HTML(source, base_url=args.base_url, encoding=args.encoding,
                 media_type=args.media_type)
     html.write_pdf(output, **kwargs)
@@ -12,7 +12,11 @@ on other functions in this module.
 
 """
 
-from collections import namedtuple
+import copy
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, namedtuple
 from logging import DEBUG, WARNING
 
 import cssselect2
@@ -24,6 +28,7 @@ from ..logger import LOGGER, PROGRESS_LOGGER
 from ..urls import URLFetchingError, get_url_attribute, url_join
 from . import computed_values, counters, media_queries
 from .properties import INHERITED, INITIAL_NOT_COMPUTED, INITIAL_VALUES
+from .selectors import Matcher, compile_selector_list, element_bits
 from .utils import get_url, remove_whitespace
 from .validation import preprocess_declarations
 from .validation.descriptors import preprocess_descriptors
@@ -36,6 +41,43 @@ PSEUDO_ELEMENTS = (
 
 PageType = namedtuple('PageType', ['side', 'blank', 'first', 'index', 'name'])
 
+# Stylesheets of <style> elements, shared by documents and indexed by their
+# content, base URL and media type
+StylesheetCacheEntry = namedtuple(
+    'StylesheetCacheEntry',
+    ['css', 'font_faces', 'counter_styles', 'log_records'])
+STYLESHEET_CACHE = OrderedDict()
+STYLESHEET_CACHE_SIZE = 64
+STYLESHEET_CACHE_LOCK = threading.Lock()
+
+
+class PicklableMatcher(Matcher):
+    """Selector matcher that can be serialized with :mod:`pickle`.
+
+    Compiled selectors can't be pickled. Selectors are stored as strings with
+    their declarations, and compiled again when the matcher is unpickled.
+
+    """
+    def __init__(self):
+        super().__init__()
+        self.rules = []
+
+    def __reduce__(self):
+        return _unpickle_matcher, (self.rules,)
+
+
+def _unpickle_matcher(rules):
+    matcher = PicklableMatcher()
+    matcher.rules = rules
+    for prelude, declarations in rules:
+        for selector in compile_selector_list(
+                tinycss2.parse_component_value_list(prelude)):
+            matcher.add_selector(selector, declarations)
+            if selector.pseudo_element not in PSEUDO_ELEMENTS:
+                # Following selectors have been ignored
+                break
+    return matcher
+
 
 class StyleFor:
     """Convenience function to get the computed styles for an element."""
@@ -60,6 +102,29 @@ class StyleFor:
 
         self._sheets = sheets
 
+        # Whether elements or pseudo-elements have a fixed position, their
+        # boxes are then displayed on all the pages
+        self.uses_fixed_position = False
+
+        # keys: (element tag and attributes, matched rules, parent style)
+        # values: style objects shared by elements with these keys, see
+        #     ComputedStyle.shared_style
+        self._shared_styles = {}
+
+        # keys: page type signatures, see _page_type_signature
+        # values: dicts of
+        #     keys: pseudo_element_type, None for pages
+        #     values: cascaded styles, like in cascaded_styles
+        self._page_cascades = {}
+
+        # :nth() arguments of page selectors, used by page type signatures
+        self._page_indexes = tuple({
+            selector_page_type.index
+            for sheet, _origin, _specificity in sheets
+            for _rule, selector_list, _declarations in sheet.page_rules
+            for _specificity, _pseudo_type, selector_page_type in selector_list
+            if selector_page_type.index is not None})
+
         PROGRESS_LOGGER.info('Step 3 - Applying CSS')
         for specificity, attributes in find_style_attributes(
                 html.etree_element, presentational_hints, html.base_url):
@@ -78,11 +143,27 @@ class StyleFor:
         # computed styles before their children, for inheritance.
 
         # Iterate on all elements, even if there is no cascaded style for them.
+        # keys: elements
+        # values: ancestor filters for their children, see css.selectors
+        ancestor_filters = {}
         for element in html.wrapper_element.iter_subtree():
-            for sheet, origin, sheet_specificity in sheets:
+            if element.parent is None:
+                ancestor_bits = 0
+            else:
+                ancestor_bits = ancestor_filters[element.parent.etree_element]
+            ancestor_filters[element.etree_element] = (
+                ancestor_bits | element_bits(element))
+            matched_rules = []
+            for i, (sheet, origin, sheet_specificity) in enumerate(sheets):
                 # Add declarations for matched elements
-                for selector in sheet.matcher.match(element):
+                if isinstance(sheet.matcher, Matcher):
+                    selectors = sheet.matcher.match(element, ancestor_bits)
+                else:
+                    selectors = sheet.matcher.match(element)
+                for selector in selectors:
                     specificity, order, pseudo_type, declarations = selector
+                    if pseudo_type is None:
+                        matched_rules.append((i, order))
                     specificity = sheet_specificity or specificity
                     style = cascaded_styles.setdefault(
                         (element.etree_element, pseudo_type), {})
@@ -93,9 +174,14 @@ class StyleFor:
                         if old_weight is None or old_weight <= weight:
                             style[name] = values, weight
             parent = element.parent.etree_element if element.parent else None
+            etree_element = element.etree_element
+            share_key = (
+                etree_element.tag, tuple(etree_element.attrib.items()),
+                tuple(matched_rules))
             self.set_computed_styles(
-                element.etree_element, root=html.etree_element, parent=parent,
-                base_url=html.base_url, target_collector=target_collector)
+                etree_element, root=html.etree_element, parent=parent,
+                base_url=html.base_url, target_collector=target_collector,
+                share_key=share_key)
 
         # Then computed styles for pseudo elements, in any order.
         # Pseudo-elements inherit from their associated element so they come
@@ -120,7 +206,7 @@ class StyleFor:
     def __call__(self, element, pseudo_type=None):
         style = self._computed_styles.get((element, pseudo_type))
 
-        if style:
+        if style is not None:
             if ('table' in style['display'] and
                     style['border_collapse'] == 'collapse'):
                 # Padding do not apply
@@ -136,13 +222,17 @@ class StyleFor:
         return style
 
     def set_computed_styles(self, element, parent, root=None, pseudo_type=None,
-                            base_url=None, target_collector=None):
+                            base_url=None, target_collector=None,
+                            share_key=None):
         """Set the computed values of styles to ``element``.
 
         Take the properties left by ``apply_style_rule`` on an element or
         pseudo-element and assign computed values with respect to the cascade,
         declaration priority (ie. ``!important``) and selector specificity.
 
+        Elements with the same ``share_key`` and the same parent style have the
+        same cascaded styles, their values are computed only once.
+
         """
         cascaded_styles = self.get_cascaded_styles()
         computed_styles = self.get_computed_styles()
@@ -160,9 +250,22 @@ class StyleFor:
             root_style = computed_styles[root, None]
 
         cascaded = cascaded_styles.get((element, pseudo_type), {})
-        computed_styles[element, pseudo_type] = computed_from_cascaded(
+        shared_style = None
+        if share_key is not None and cascaded and parent_style is not None:
+            # Children of elements sharing a style can share their styles too
+            parent_key = getattr(parent_style, 'shared_style', None)
+            share_key = (*share_key, id(
+                parent_style if parent_key is None else parent_key))
+            shared_style = self._shared_styles.get(share_key)
+            if shared_style is None:
+                shared_style = self._shared_styles[share_key] = ComputedStyle(
+                    parent_style, cascaded, element, pseudo_type, root_style,
+                    base_url)
+        style = computed_styles[element, pseudo_type] = computed_from_cascaded(
             element, cascaded, parent_style, pseudo_type, root_style, base_url,
-            target_collector)
+            target_collector, shared_style)
+        if not isinstance(element, PageType) and style['position'] == 'fixed':
+            self.uses_fixed_position = True
 
         # The style of marker is deleted when display is different from
         # list-item.
@@ -177,21 +280,103 @@ class StyleFor:
                     del cascaded_styles[element, 'marker']
 
     def add_page_declarations(self, page_type):
-        for sheet, origin, sheet_specificity in self._sheets:
-            for _rule, selector_list, declarations in sheet.page_rules:
-                for selector in selector_list:
-                    specificity, pseudo_type, selector_page_type = selector
-                    if self._page_type_match(selector_page_type, page_type):
-                        specificity = sheet_specificity or specificity
-                        style = self._cascaded_styles.setdefault(
-                            (page_type, pseudo_type), {})
-                        for name, values, importance in declarations:
-                            precedence = declaration_precedence(
-                                origin, importance)
-                            weight = (precedence, specificity)
-                            old_weight = style.get(name, (None, None))[1]
-                            if old_weight is None or old_weight <= weight:
-                                style[name] = values, weight
+        """Set the cascaded styles of ``page_type`` and its margin boxes.
+
+        Page types with the same signature are matched by the same page
+        selectors, the cascade is only done once for all of them.
+
+        Return the signature of ``page_type``.
+
+        """
+        signature = self._page_type_signature(page_type)
+        cascades = self._page_cascades.get(signature)
+        if cascades is None:
+            cascades = self._page_cascades[signature] = {}
+            for sheet, origin, sheet_specificity in self._sheets:
+                for _rule, selector_list, declarations in sheet.page_rules:
+                    for selector in selector_list:
+                        specificity, pseudo_type, selector_page_type = selector
+                        if self._page_type_match(
+                                selector_page_type, page_type):
+                            specificity = sheet_specificity or specificity
+                            style = cascades.setdefault(pseudo_type, {})
+                            for name, values, importance in declarations:
+                                precedence = declaration_precedence(
+                                    origin, importance)
+                                weight = (precedence, specificity)
+                                old_weight = style.get(name, (None, None))[1]
+                                if old_weight is None or old_weight <= weight:
+                                    style[name] = values, weight
+        for pseudo_type, style in cascades.items():
+            self._cascaded_styles[page_type, pseudo_type] = style
+        return signature
+
+    def set_page_computed_styles(self, page_type, html):
+        """Set the computed styles of ``page_type`` and its margin boxes.
+
+        Page types with the same signature share their computed values, see
+        :meth:`set_computed_styles`.
+
+        """
+        signature = self.add_page_declarations(page_type)
+
+        # Apply style for page
+        self.set_computed_styles(
+            page_type,
+            # @page inherits from the root element:
+            # http://lists.w3.org/Archives/Public/www-style/2012Jan/1164.html
+            root=html.etree_element, parent=html.etree_element,
+            base_url=html.base_url, share_key=('@page', signature, None))
+
+        # Apply style for page pseudo-elements (margin boxes)
+        for pseudo_type in self._page_cascades[signature]:
+            if pseudo_type:
+                self.set_computed_styles(
+                    page_type, pseudo_type=pseudo_type,
+                    # The pseudo-element inherits from the element.
+                    root=html.etree_element, parent=page_type,
+                    base_url=html.base_url,
+                    share_key=('@page', signature, pseudo_type))
+
+    def _page_type_signature(self, page_type):
+        """Get a key shared by page types matched by the same selectors."""
+        indexes = tuple(
+            self._page_type_match(PageType(
+                side=None, blank=None, first=None, index=index, name=None),
+                page_type)
+            for index in self._page_indexes)
+        return (
+            page_type.side, page_type.blank, page_type.first, page_type.name,
+            indexes)
+
+    def page_rules_use_following_pages(self):
+        """Return whether page and margin rules depend on following pages.
+
+        Values of the ``pages`` counter and of ``target-*()`` functions are
+        only known once the following pages are laid out. Contents set by
+        ``var()`` functions may include these values too.
+
+        """
+        def uses_following_pages(values):
+            if isinstance(values, (tuple, list)):
+                if values and values[0] in ('counter()', 'counters()'):
+                    return values[1][0] == 'pages'
+                if values and values[0] in (
+                        'target-counter()', 'target-counters()',
+                        'target-text()'):
+                    return True
+                return any(uses_following_pages(value) for value in values)
+            return False
+
+        def uses_variable(values):
+            return isinstance(values, tuple) and values[:1] == ('var()',)
+
+        return any(
+            uses_following_pages(values) or (
+                name == 'content' and uses_variable(values))
+            for sheet, _origin, _specificity in self._sheets
+            for _rule, _selector_list, declarations in sheet.page_rules
+            for name, values, _importance in declarations)
 
     def get_cascaded_styles(self):
         return self._cascaded_styles
@@ -253,14 +438,9 @@ def find_stylesheets(wrapper_element, device_media_type, url_fetcher, base_url,
             # Content is text that is directly in the <style> element, not its
             # descendants
             content = get_child_text(element)
-            # ElementTree should give us either unicode or ASCII-only
-            # bytestrings, so we don't need `encoding` here.
-            css = CSS(
-                string=content, base_url=base_url,
-                url_fetcher=url_fetcher, media_type=device_media_type,
-                font_config=font_config, counter_style=counter_style,
-                page_rules=page_rules)
-            yield css
+            yield get_cached_stylesheet(
+                content, base_url, url_fetcher, device_media_type,
+                font_config, counter_style, page_rules)
         elif element.tag == 'link' and element.get('href'):
             if not element_has_link_type(element, 'stylesheet') or \
                     element_has_link_type(element, 'alternate'):
@@ -278,6 +458,103 @@ def find_stylesheets(wrapper_element, device_media_type, url_fetcher, base_url,
                         'Failed to load stylesheet at %s: %s', href, exc)
 
 
+class _LogRecorder(logging.Filter):
+    """Logging filter storing the records logged by the current thread."""
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        self._thread = threading.get_ident()
+
+    def filter(self, record):
+        if record.thread == self._thread:
+            self.records.append(record)
+        return True
+
+
+class _FontFaceRecorder:
+    """Font configuration storing ``@font-face`` rules to add them later."""
+    def __init__(self):
+        self.font_faces = []
+
+    def add_font_face(self, rule_descriptors, url_fetcher):
+        self.font_faces.append(rule_descriptors)
+
+
+def get_cached_stylesheet(content, base_url, url_fetcher, device_media_type,
+                          font_config, counter_style, page_rules):
+    """Get the stylesheet of a ``<style>`` element.
+
+    Stylesheets are parsed once and kept in ``STYLESHEET_CACHE``. The
+    ``@font-face`` and ``@counter-style`` rules of cached stylesheets are
+    added again to ``font_config`` and ``counter_style``, and the messages
+    logged while parsing are logged again.
+
+    Stylesheets including other stylesheets are not cached, as the imported
+    stylesheets may change.
+
+    """
+    content_hash = hashlib.sha256(content.encode('utf-8', 'surrogatepass'))
+    key = (content_hash.digest(), base_url, device_media_type)
+    with STYLESHEET_CACHE_LOCK:
+        entry = STYLESHEET_CACHE.get(key)
+        if entry is not None:
+            STYLESHEET_CACHE.move_to_end(key)
+
+    if entry is not None:
+        for record in entry.log_records:
+            if LOGGER.isEnabledFor(record.levelno):
+                LOGGER.handle(record)
+    else:
+        imported_urls = []
+
+        def recording_url_fetcher(url):
+            # Only called by @import rules, @font-face rules are recorded
+            imported_urls.append(url)
+            return url_fetcher(url)
+
+        font_recorder = _FontFaceRecorder()
+        recording_counter_style = counters.CounterStyle(counter_style or {})
+        log_recorder = _LogRecorder()
+        LOGGER.addFilter(log_recorder)
+        try:
+            # ElementTree should give us either unicode or ASCII-only
+            # bytestrings, so we don't need `encoding` here.
+            css = CSS(
+                string=content, base_url=base_url,
+                url_fetcher=recording_url_fetcher,
+                media_type=device_media_type, font_config=font_recorder,
+                counter_style=recording_counter_style)
+        finally:
+            LOGGER.removeFilter(log_recorder)
+        entry = StylesheetCacheEntry(
+            css, font_recorder.font_faces, {
+                name: counter
+                for name, counter in recording_counter_style.items()
+                if (counter_style or {}).get(name) is not counter},
+            log_recorder.records)
+        if not imported_urls:
+            with STYLESHEET_CACHE_LOCK:
+                STYLESHEET_CACHE[key] = entry
+                while len(STYLESHEET_CACHE) > STYLESHEET_CACHE_SIZE:
+                    STYLESHEET_CACHE.popitem(last=False)
+
+    # Page rules and fonts are stored with the document's ones
+    css = copy.copy(entry.css)
+    if page_rules is not None:
+        page_rules.extend(entry.css.page_rules)
+        css.page_rules = page_rules
+    css.fonts = []
+    if font_config is not None:
+        for rule_descriptors in entry.font_faces:
+            font_filename = font_config.add_font_face(
+                rule_descriptors, url_fetcher)
+            if font_filename:
+                css.fonts.append(font_filename)
+    if counter_style is not None:
+        counter_style.update(entry.counter_styles)
+    return css
+
+
 def find_style_attributes(tree, presentational_hints=False, base_url=None):
     """Yield ``specificity, (element, declaration, base_url)`` rules.
 
@@ -587,6 +864,8 @@ def declaration_precedence(origin, importance):
 
 class AnonymousStyle(dict):
     """Computed style used for anonymous boxes."""
+    __slots__ = ('parent_style', 'specified')
+
     def __init__(self, parent_style):
         # border-*-style is none, so border-width computes to zero.
         # Other than that, properties that would need computing are
@@ -618,10 +897,21 @@ class AnonymousStyle(dict):
 
 
 class ComputedStyle(dict):
-    """Computed style used for non-anonymous boxes."""
+    """Computed style used for non-anonymous boxes.
+
+    Values are computed when they are requested. When ``shared_style`` is
+    given, values are read from this style, shared by elements whose values
+    are known to be the same, and are not stored in this style. Only values
+    set later are stored in this style, overriding shared values.
+
+    """
+    __slots__ = (
+        'specified', 'parent_style', 'cascaded', 'is_root_element', 'element',
+        'pseudo_type', 'root_style', 'base_url', 'shared_style')
+
     def __init__(self, parent_style, cascaded, element, pseudo_type,
-                 root_style, base_url):
-        self.specified = {}
+                 root_style, base_url, shared_style=None):
+        self.specified = {} if shared_style is None else shared_style.specified
         self.parent_style = parent_style
         self.cascaded = cascaded
         self.is_root_element = parent_style is None
@@ -629,16 +919,20 @@ class ComputedStyle(dict):
         self.pseudo_type = pseudo_type
         self.root_style = root_style
         self.base_url = base_url
+        self.shared_style = shared_style
 
     def copy(self):
         copy = ComputedStyle(
             self.parent_style, self.cascaded, self.element, self.pseudo_type,
-            self.root_style, self.base_url)
+            self.root_style, self.base_url, self.shared_style)
         copy.update(self)
         copy.specified = self.specified.copy()
         return copy
 
     def __missing__(self, key):
+        if self.shared_style is not None:
+            return self.shared_style[key]
+
         if key == 'float':
             # Set specified value for position, needed for computed value
             self['position']
@@ -682,6 +976,10 @@ class ComputedStyle(dict):
         if key in self:
             return self[key]
 
+        if key.startswith('__'):
+            # Custom properties are resolved once per element
+            return computed_values.resolve_custom_property(self, key, value)
+
         function = computed_values.COMPUTER_FUNCTIONS.get(key)
         already_computed_value = False
 
@@ -710,13 +1008,14 @@ class ComputedStyle(dict):
 
 def computed_from_cascaded(element, cascaded, parent_style, pseudo_type=None,
                            root_style=None, base_url=None,
-                           target_collector=None):
+                           target_collector=None, shared_style=None):
     """Get a dict of computed style mixed from parent and cascaded styles."""
     if not cascaded and parent_style is not None:
         return AnonymousStyle(parent_style)
 
     style = ComputedStyle(
-        parent_style, cascaded, element, pseudo_type, root_style, base_url)
+        parent_style, cascaded, element, pseudo_type, root_style, base_url,
+        shared_style)
     if target_collector:
         target_collector.collect_anchor(style['anchor'])
     return style
@@ -859,7 +1158,10 @@ def preprocess_stylesheet(device_media_type, base_url, stylesheet_rules,
             if declarations:
                 logger_level = WARNING
                 try:
-                    selectors = cssselect2.compile_selector_list(rule.prelude)
+                    selectors = compile_selector_list(rule.prelude)
+                    if isinstance(matcher, PicklableMatcher):
+                        matcher.rules.append(
+                            (tinycss2.serialize(rule.prelude), declarations))
                     for selector in selectors:
                         matcher.add_selector(selector, declarations)
                         if selector.pseudo_element not in PSEUDO_ELEMENTS:
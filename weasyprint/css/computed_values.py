@@ -1,6 +1,7 @@
 """Convert specified property values into computed values."""
 
 from collections import OrderedDict
+from copy import copy
 from urllib.parse import unquote
 
 from tinycss2.color3 import parse_color
@@ -18,6 +19,20 @@ from .validation.properties import PROPERTIES
 
 ZERO_PIXELS = Dimension(0, 'px')
 
+# Computed absolute, em and rem lengths, keyed by specified value, font size
+# and pixels_only, with the number of cache hits and misses
+COMPUTED_LENGTHS = {}
+COMPUTED_LENGTHS_MAX_SIZE = 4096
+COMPUTED_LENGTHS_STATS = {'hits': 0, 'misses': 0}
+
+# Parsed values substituted to var() functions, keyed by property name,
+# tokens and base URL
+VARIABLE_VALUES = {}
+VARIABLE_VALUES_MAX_SIZE = 4096
+
+# Value of the custom properties being resolved, to detect reference cycles
+RESOLVING = object()
+
 
 # Value in pixels of font-size for <absolute-size> keywords: 12pt (16px) for
 # medium, and scaling factors given in CSS3 for others:
@@ -148,34 +163,75 @@ COMPUTING_ORDER = _computing_order()
 COMPUTER_FUNCTIONS = {}
 
 
-def _resolve_var(computed, variable_name, default, parent_style):
-    known_variable_names = [variable_name]
-
-    computed_value = computed[variable_name]
-    if computed_value and len(computed_value) == 1:
-        value = computed_value[0]
-        if value.type == 'ident' and value.value == 'initial':
-            return default
-
-    computed_value = computed.get(variable_name, default)
-    while (computed_value and
-            isinstance(computed_value, tuple)
-            and len(computed_value) == 1):
-        var_function = check_var_function(computed_value[0])
-        if var_function:
-            new_variable_name, new_default = var_function[1]
-            if new_variable_name in known_variable_names:
-                computed_value = default
-                break
-            known_variable_names.append(new_variable_name)
-            if new_variable_name in computed:
-                computed_value = computed[new_variable_name]
-            else:
-                computed_value = parent_style[new_variable_name] or new_default
-            default = new_default
-        else:
+class _ReferenceCycle(Exception):
+    """Reference cycle between custom properties, found at ``args[0]``."""
+
+
+def resolve_custom_property(computed, name, tokens):
+    """Resolve and store the value of the custom property ``name``.
+
+    When the value is a ``var()`` function, the value of the referenced
+    custom property in ``computed`` is used, or the default value if this
+    custom property is not defined. Referenced custom properties are
+    resolved once per element, and inherited values are already resolved.
+
+    All the custom properties of a reference cycle are invalid, even if they
+    have default values.
+
+    Return ``None`` for the guaranteed-invalid value.
+
+    """
+    computed[name] = RESOLVING
+    try:
+        value = _resolve_custom_property_tokens(computed, tokens)
+    except _ReferenceCycle as cycle:
+        computed[name] = None
+        if cycle.args[0] != name:
+            # Other properties of the cycle are resolved by the callers
+            raise
+        return None
+    computed[name] = value
+    return value
+
+
+def _resolve_custom_property_tokens(computed, tokens):
+    """Follow the ``var()`` functions of a custom property value."""
+    while tokens and len(tokens) == 1:
+        token, = tokens
+        if token.type == 'ident' and token.value == 'initial':
+            return None
+        var_function = check_var_function(token)
+        if not var_function:
             break
-    return computed_value
+        variable_name, default = var_function[1]
+        value = computed[variable_name]
+        if value is RESOLVING:
+            raise _ReferenceCycle(variable_name)
+        tokens = value or default
+    return tokens
+
+
+def _resolve_var(computed, variable_name, default):
+    """Get the value of the custom property used by a var() function."""
+    return computed[variable_name] or default
+
+
+def _parse_variable_value(name, tokens, base_url):
+    """Parse the value substituted to a var() function, using a cache."""
+    prop = PROPERTIES[name.replace('_', '-')]
+    tokens = tuple(tokens)
+    key = (name, tokens, base_url if prop.wants_base_url else None)
+    if key in VARIABLE_VALUES:
+        return VARIABLE_VALUES[key]
+
+    if prop.wants_base_url:
+        value = prop(tokens, base_url)
+    else:
+        value = prop(tokens)
+    if len(VARIABLE_VALUES) >= VARIABLE_VALUES_MAX_SIZE:
+        VARIABLE_VALUES.clear()
+    VARIABLE_VALUES[key] = value
+    return value
 
 
 def register_computer(name):
@@ -194,16 +250,12 @@ def compute_variable(value, name, computed, base_url, parent_style):
 
     if value and isinstance(value, tuple) and value[0] == 'var()':
         variable_name, default = value[1]
-        computed_value = _resolve_var(
-            computed, variable_name, default, parent_style)
+        computed_value = _resolve_var(computed, variable_name, default)
         if computed_value is None:
             new_value = None
         else:
-            prop = PROPERTIES[name.replace('_', '-')]
-            if prop.wants_base_url:
-                new_value = prop(computed_value, base_url)
-            else:
-                new_value = prop(computed_value)
+            new_value = _parse_variable_value(
+                name, computed_value, base_url)
 
         # See https://drafts.csswg.org/css-variables/#invalid-variables
         if new_value is None:
@@ -216,7 +268,7 @@ def compute_variable(value, name, computed, base_url, parent_style):
                 'Unsupported computed value "%s" set in variable %r '
                 'for property %r.', computed_value,
                 variable_name.replace('_', '-'), name.replace('_', '-'))
-            if name in INHERITED and parent_style:
+            if name in INHERITED and parent_style is not None:
                 already_computed_value = True
                 value = parent_style[name]
             else:
@@ -232,8 +284,11 @@ def compute_variable(value, name, computed, base_url, parent_style):
 @register_computer('background-image')
 def background_image(style, name, values):
     """Compute lenghts in gradient background-image."""
+    images = []
     for type_, value in values:
         if type_ in ('linear-gradient', 'radial-gradient'):
+            # Specified values can be shared by multiple styles
+            value = copy(value)
             value.stop_positions = tuple(
                 length(style, name, pos) if pos is not None else None
                 for pos in value.stop_positions)
@@ -243,7 +298,8 @@ def background_image(style, name, values):
             if value.size_type == 'explicit':
                 value.size = length_or_percentage_tuple(
                     style, name, value.size)
-    return values
+        images.append((type_, value))
+    return tuple(images)
 
 
 @register_computer('background-position')
@@ -316,8 +372,15 @@ def length(style, name, value, font_size=None, pixels_only=False):
         return value.value if pixels_only else value
     elif unit in LENGTHS_TO_PIXELS:
         # Convert absolute lengths to pixels
-        result = value.value * LENGTHS_TO_PIXELS[unit]
-    elif unit in ('em', 'ex', 'ch', 'rem'):
+        return _computed_length(value, None, pixels_only)
+    elif unit == 'em':
+        if font_size is None:
+            font_size = style['font_size']
+        return _computed_length(value, font_size, pixels_only)
+    elif unit == 'rem':
+        return _computed_length(
+            value, style.root_style['font_size'], pixels_only)
+    elif unit in ('ex', 'ch'):
         if font_size is None:
             font_size = style['font_size']
         if unit == 'ex':
@@ -333,10 +396,6 @@ def length(style, name, value, font_size=None, pixels_only=False):
             line, _ = layout.get_first_line()
             logical_width, _ = line_size(line, style)
             result = value.value * logical_width
-        elif unit == 'em':
-            result = value.value * font_size
-        elif unit == 'rem':
-            result = value.value * style.root_style['font_size']
     else:
         # A percentage or 'auto': no conversion needed.
         return value
@@ -344,6 +403,33 @@ def length(style, name, value, font_size=None, pixels_only=False):
     return result if pixels_only else Dimension(result, 'px')
 
 
+def _computed_length(value, font_size, pixels_only):
+    """Compute an absolute, ``em`` or ``rem`` length, using a cache.
+
+    ``font_size`` is the font size used for ``em`` and ``rem`` lengths, and
+    is ``None`` for absolute lengths. Cached results are shared between
+    styles.
+
+    """
+    key = (value, font_size, pixels_only)
+    result = COMPUTED_LENGTHS.get(key)
+    if result is not None:
+        COMPUTED_LENGTHS_STATS['hits'] += 1
+        return result
+
+    COMPUTED_LENGTHS_STATS['misses'] += 1
+    if font_size is None:
+        result = value.value * LENGTHS_TO_PIXELS[value.unit]
+    else:
+        result = value.value * font_size
+    if not pixels_only:
+        result = Dimension(result, 'px')
+    if len(COMPUTED_LENGTHS) >= COMPUTED_LENGTHS_MAX_SIZE:
+        COMPUTED_LENGTHS.clear()
+    COMPUTED_LENGTHS[key] = result
+    return result
+
+
 @register_computer('bleed-left')
 @register_computer('bleed-right')
 @register_computer('bleed-top')
@@ -0,0 +1,195 @@
+"""Compile and match selectors.
+
+Selectors are compiled and tested by cssselect2. The matcher defined here keeps
+the selectors in buckets, and uses an ancestor filter to skip the selectors
+requiring ancestors that the tested element doesn't have.
+
+"""
+
+from cssselect2 import parser
+from cssselect2.compiler import CompiledSelector
+
+# Number of bits in ancestor filters
+ANCESTOR_FILTER_SIZE = 256
+
+
+def _feature_bit(kind, value):
+    """Get the bit representing a tag name, an id or a class in filters."""
+    return 1 << (hash((kind, value)) % ANCESTOR_FILTER_SIZE)
+
+
+def _compound_bits(compound):
+    """Get the filter bits of the features required by a compound selector."""
+    bits = 0
+    for simple_selector in compound.simple_selectors:
+        if isinstance(simple_selector, parser.LocalNameSelector):
+            bits |= _feature_bit('tag', simple_selector.lower_local_name)
+        elif isinstance(simple_selector, parser.IDSelector):
+            bits |= _feature_bit('id', simple_selector.ident)
+        elif isinstance(simple_selector, parser.ClassSelector):
+            bits |= _feature_bit('class', simple_selector.class_name)
+    return bits
+
+
+def element_bits(element):
+    """Get the filter bits of the tag name, id and classes of ``element``."""
+    bits = _feature_bit('tag', element.local_name.lower())
+    if element.id is not None:
+        bits |= _feature_bit('id', element.id)
+    for class_name in element.classes:
+        bits |= _feature_bit('class', class_name)
+    return bits
+
+
+def compile_selector_list(tokens):
+    """Compile a comma-separated list of selectors.
+
+    Compiled selectors are cssselect2 selectors, with two more attributes:
+    ``ancestor_bits``, the filter bits of the features required in the
+    ancestors, and ``attribute_name``, the name of an attribute required by
+    the rightmost compound selector.
+
+    """
+    selectors = []
+    for parsed_selector in parser.parse(tokens):
+        selector = CompiledSelector(parsed_selector)
+        selector.ancestor_bits = 0
+        selector.attribute_name = None
+
+        tree = parsed_selector.parsed_tree
+        compound = tree.right if isinstance(
+            tree, parser.CombinedSelector) else tree
+        for simple_selector in compound.simple_selectors:
+            if isinstance(simple_selector, parser.AttributeSelector) and (
+                    simple_selector.namespace == ''):
+                selector.attribute_name = simple_selector.lower_name
+                break
+
+        while isinstance(tree, parser.CombinedSelector):
+            left = tree.left
+            compound = left.right if isinstance(
+                left, parser.CombinedSelector) else left
+            # Compound selectors followed by sibling combinators match
+            # siblings, not ancestors
+            if tree.combinator in (' ', '>'):
+                selector.ancestor_bits |= _compound_bits(compound)
+            tree = left
+
+        selectors.append(selector)
+    return selectors
+
+
+class Matcher:
+    """Selector matcher using ancestor filters.
+
+    Selectors are stored in buckets like cssselect2 matchers do, with an
+    additional bucket for selectors only requiring attributes. The matcher
+    doesn't inherit from :class:`cssselect2.Matcher`, whose buckets are not
+    part of the public API of cssselect2.
+
+    :meth:`match` accepts an optional ancestor filter, the union of
+    :func:`element_bits` for all the ancestors of the element. Selectors
+    requiring ancestors missing from the filter are not tested.
+
+    """
+    def __init__(self):
+        self.id_selectors = {}
+        self.class_selectors = {}
+        self.lower_local_name_selectors = {}
+        self.namespace_selectors = {}
+        self.lang_attr_selectors = []
+        self.attribute_selectors = {}
+        self.other_selectors = []
+        self.order = 0
+
+    def add_selector(self, selector, payload):
+        """Add a compiled selector and its payload to the matcher."""
+        self.order += 1
+
+        if selector.never_matches:
+            return
+
+        entry = (
+            selector.test, selector.specificity, self.order,
+            selector.pseudo_element, payload,
+            getattr(selector, 'ancestor_bits', 0))
+        attribute_name = getattr(selector, 'attribute_name', None)
+        if selector.id is not None:
+            self.id_selectors.setdefault(selector.id, []).append(entry)
+        elif selector.class_name is not None:
+            self.class_selectors.setdefault(
+                selector.class_name, []).append(entry)
+        elif selector.local_name is not None:
+            self.lower_local_name_selectors.setdefault(
+                selector.lower_local_name, []).append(entry)
+        elif selector.namespace is not None:
+            self.namespace_selectors.setdefault(
+                selector.namespace, []).append(entry)
+        elif selector.requires_lang_attr:
+            self.lang_attr_selectors.append(entry)
+        elif attribute_name is not None:
+            self.attribute_selectors.setdefault(
+                attribute_name, []).append(entry)
+        else:
+            self.other_selectors.append(entry)
+
+    def match(self, element, ancestor_bits=None):
+        """Get the selectors matching ``element``, sorted by specificity.
+
+        Matching selectors are returned as ``(specificity, order,
+        pseudo_element, payload)`` tuples.
+
+        """
+        relevant_selectors = []
+        add_relevant_selectors = self._add_relevant_selectors
+
+        if element.id is not None and element.id in self.id_selectors:
+            add_relevant_selectors(
+                element, self.id_selectors[element.id], relevant_selectors,
+                ancestor_bits)
+
+        for class_name in element.classes:
+            if class_name in self.class_selectors:
+                add_relevant_selectors(
+                    element, self.class_selectors[class_name],
+                    relevant_selectors, ancestor_bits)
+
+        lower_name = element.local_name.lower()
+        if lower_name in self.lower_local_name_selectors:
+            add_relevant_selectors(
+                element, self.lower_local_name_selectors[lower_name],
+                relevant_selectors, ancestor_bits)
+        if element.namespace_url in self.namespace_selectors:
+            add_relevant_selectors(
+                element, self.namespace_selectors[element.namespace_url],
+                relevant_selectors, ancestor_bits)
+
+        attributes = element.etree_element.attrib
+        if 'lang' in attributes:
+            add_relevant_selectors(
+                element, self.lang_attr_selectors, relevant_selectors,
+                ancestor_bits)
+        if self.attribute_selectors:
+            for name in attributes:
+                name = name.lower()
+                if name in self.attribute_selectors:
+                    add_relevant_selectors(
+                        element, self.attribute_selectors[name],
+                        relevant_selectors, ancestor_bits)
+
+        add_relevant_selectors(
+            element, self.other_selectors, relevant_selectors, ancestor_bits)
+
+        relevant_selectors.sort()
+        return relevant_selectors
+
+    @staticmethod
+    def _add_relevant_selectors(element, selectors, relevant_selectors,
+                                ancestor_bits):
+        for test, specificity, order, pseudo, payload, bits in selectors:
+            if ancestor_bits is not None and bits & ancestor_bits != bits:
+                # Required ancestors are missing
+                continue
+            if test(element):
+                relevant_selectors.append(
+                    (specificity, order, pseudo, payload))
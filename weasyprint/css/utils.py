@@ -151,6 +151,36 @@ def safe_urljoin(base_url, url):
             f'Relative URI reference without a base URI: {url!r}')
 
 
+def find_urls(nodes, base_url):
+    """Yield the absolute URLs referenced by a list of CSS nodes.
+
+    ``nodes`` can be rules, declarations or component values, the URLs in
+    their preludes, contents, values and arguments are included.
+
+    """
+    for node in nodes:
+        url = None
+        if node.type == 'url':
+            url = node.value
+        elif node.type == 'function' and node.lower_name == 'url':
+            arguments = remove_whitespace(node.arguments)
+            if len(arguments) == 1 and arguments[0].type == 'string':
+                url = arguments[0].value
+        elif node.type == 'at-rule' and node.lower_at_keyword == 'import':
+            prelude = remove_whitespace(node.prelude)
+            if prelude and prelude[0].type == 'string':
+                url = prelude[0].value
+        if url and not url.startswith('#'):
+            if url_is_absolute(url):
+                yield iri_to_uri(url)
+            elif base_url:
+                yield iri_to_uri(urljoin(base_url, url))
+        for attribute in ('prelude', 'content', 'value', 'arguments'):
+            children = getattr(node, attribute, None)
+            if isinstance(children, list):
+                yield from find_urls(children, base_url)
+
+
 def comma_separated_list(function):
     """Decorator for validators that accept a comma separated list."""
     @functools.wraps(function)
@@ -1,16 +1,17 @@
 """Document generation management."""
 
 import collections
+import copy
 import functools
 import hashlib
 import io
 import math
-import shutil
-import struct
 import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
 from os.path import basename
 from urllib.parse import unquote, urlsplit
 
+import fontTools
 import pydyf
 from fontTools import subset
 from fontTools.ttLib import TTFont, TTLibError, ttFont
@@ -22,7 +23,7 @@ from .css.targets import TargetCollector
 from .draw import draw_page, stacked
 from .formatting_structure import boxes
 from .formatting_structure.build import build_formatting_structure
-from .html import W3C_DATE_RE, get_html_metadata
+from .html import W3C_DATE_RE, get_html_metadata, prefetch_resources
 from .images import get_image_from_uri as original_get_image_from_uri
 from .layout import LayoutContext, layout_document
 from .layout.percent import percentage
@@ -117,10 +118,27 @@ class Font:
         return flags
 
 
+def _encode_image(image, interpolate):
+    """Get an XObject for ``image``, and a copy kept by the original image.
+
+    When images are encoded by executors using other processes, encoded
+    images are not stored in the images of the main process, the copy is
+    given to ``_keep_x_object``.
+
+    """
+    return image.get_x_object(interpolate), image.get_x_object(interpolate)
+
+
+def _keep_x_object(image, interpolate, future):
+    """Keep the XObject encoded by ``future`` in ``image``."""
+    if future.exception() is None:
+        image.set_x_object(interpolate, future.result()[1])
+
+
 class Stream(pydyf.Stream):
     """PDF stream object with context storing alpha states."""
     def __init__(self, document, page_rectangle, states, x_objects, patterns,
-                 shadings, images, *args, **kwargs):
+                 shadings, images, *args, executor=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.compress = True
         self.page_rectangle = page_rectangle
@@ -130,6 +148,7 @@ class Stream(pydyf.Stream):
         self._patterns = patterns
         self._shadings = shadings
         self._images = images
+        self._executor = executor
         self._current_color = self._current_color_stroke = None
         self._current_alpha = self._current_alpha_stroke = None
         self._current_font = self._current_font_size = None
@@ -251,114 +270,28 @@ class Stream(pydyf.Stream):
         })
         group = Stream(
             self._document, self.page_rectangle, states, x_objects,
-            patterns, shadings, self._images, extra=extra)
+            patterns, shadings, self._images, extra=extra,
+            executor=self._executor)
         group.id = f'x{len(self._x_objects)}'
         self._x_objects[group.id] = group
         return group
 
-    def _get_png_data(self, pillow_image, optimize):
-        image_file = io.BytesIO()
-        pillow_image.save(image_file, format='PNG', optimize=optimize)
-
-        # Read the PNG header, then discard it because we know it's a PNG. If
-        # this weren't just output from Pillow, we should actually check it.
-        image_file.seek(8)
-
-        png_data = b''
-        raw_chunk_length = image_file.read(4)
-        # PNG files consist of a series of chunks.
-        while len(raw_chunk_length) > 0:
-            # Each chunk begins with its data length (four bytes, may be zero),
-            # then its type (four ASCII characters), then the data, then four
-            # bytes of a CRC.
-            chunk_len, = struct.unpack('!I', raw_chunk_length)
-            chunk_type = image_file.read(4)
-            if chunk_type == b'IDAT':
-                png_data += image_file.read(chunk_len)
-            else:
-                image_file.seek(chunk_len, io.SEEK_CUR)
-            # We aren't checking the CRC, we assume this is a valid PNG.
-            image_file.seek(4, io.SEEK_CUR)
-            raw_chunk_length = image_file.read(4)
-
-        return png_data
-
-    def add_image(self, pillow_image, image_rendering, optimize_size):
-        image_name = f'i{pillow_image.id}'
+    def add_image(self, image, image_rendering):
+        image_name = f'i{image.id}'
         self._x_objects[image_name] = None  # Set by write_pdf
         if image_name in self._images:
             # Reuse image already stored in document
             return image_name
 
-        if 'transparency' in pillow_image.info:
-            pillow_image = pillow_image.convert('RGBA')
-        elif pillow_image.mode in ('1', 'P', 'I'):
-            pillow_image = pillow_image.convert('RGB')
-
-        if pillow_image.mode in ('RGB', 'RGBA'):
-            color_space = '/DeviceRGB'
-        elif pillow_image.mode in ('L', 'LA'):
-            color_space = '/DeviceGray'
-        elif pillow_image.mode == 'CMYK':
-            color_space = '/DeviceCMYK'
-        else:
-            LOGGER.warning('Unknown image mode: %s', pillow_image.mode)
-            color_space = '/DeviceRGB'
-
         interpolate = 'true' if image_rendering == 'auto' else 'false'
-        extra = pydyf.Dictionary({
-            'Type': '/XObject',
-            'Subtype': '/Image',
-            'Width': pillow_image.width,
-            'Height': pillow_image.height,
-            'ColorSpace': color_space,
-            'BitsPerComponent': 8,
-            'Interpolate': interpolate,
-        })
-
-        optimize = 'images' in optimize_size
-        if pillow_image.format == 'JPEG':
-            extra['Filter'] = '/DCTDecode'
-            image_file = io.BytesIO()
-            pillow_image.save(image_file, format='JPEG', optimize=optimize)
-            stream = [image_file.getvalue()]
+        if self._executor is None or image.has_x_object(interpolate):
+            self._images[image_name] = image.get_x_object(interpolate)
         else:
-            extra['Filter'] = '/FlateDecode'
-            extra['DecodeParms'] = pydyf.Dictionary({
-                # Predictor 15 specifies that we're providing PNG data,
-                # ostensibly using an "optimum predictor", but doesn't actually
-                # matter as long as the predictor value is 10+ according to the
-                # spec. (Other PNG predictor values assert that we're using
-                # specific predictors that we don't want to commit to, but
-                # "optimum" can vary.)
-                'Predictor': 15,
-                'Columns': pillow_image.width,
-            })
-            if pillow_image.mode in ('RGB', 'RGBA'):
-                # Defaults to 1.
-                extra['DecodeParms']['Colors'] = 3
-            if pillow_image.mode in ('RGBA', 'LA'):
-                alpha = pillow_image.getchannel('A')
-                pillow_image = pillow_image.convert(pillow_image.mode[:-1])
-                alpha_data = self._get_png_data(alpha, optimize)
-                extra['SMask'] = pydyf.Stream([alpha_data], extra={
-                    'Filter': '/FlateDecode',
-                    'Type': '/XObject',
-                    'Subtype': '/Image',
-                    'DecodeParms': pydyf.Dictionary({
-                        'Predictor': 15,
-                        'Columns': pillow_image.width,
-                    }),
-                    'Width': pillow_image.width,
-                    'Height': pillow_image.height,
-                    'ColorSpace': '/DeviceGray',
-                    'BitsPerComponent': 8,
-                    'Interpolate': interpolate,
-                    })
-            stream = [self._get_png_data(pillow_image, optimize)]
-
-        xobject = pydyf.Stream(stream, extra=extra)
-        self._images[image_name] = xobject
+            # Encoded in parallel, future replaced by _use_references
+            future = self._executor.submit(_encode_image, image, interpolate)
+            future.add_done_callback(
+                functools.partial(_keep_x_object, image, interpolate))
+            self._images[image_name] = future
         return image_name
 
     def add_pattern(self, width, height, repeat_width, repeat_height, matrix):
@@ -386,7 +319,7 @@ class Stream(pydyf.Stream):
         })
         pattern = Stream(
             self._document, self.page_rectangle, states, x_objects, patterns,
-            shadings, self._images, extra=extra)
+            shadings, self._images, extra=extra, executor=self._executor)
         pattern.id = f'p{len(self._patterns)}'
         self._patterns[pattern.id] = pattern
         return pattern
@@ -398,6 +331,93 @@ class Stream(pydyf.Stream):
         return shading
 
 
+def _pydyf_supports_streaming():
+    """Whether PDFWriter matches the internals of the installed pydyf."""
+    try:
+        version = tuple(int(part) for part in pydyf.VERSION.split('.')[:3])
+    except (AttributeError, ValueError):
+        return False
+    return (0, 1, 2) <= version < (0, 2)
+
+
+# PDFWriter relies on the internals of pydyf.PDF.write, PDF files are written
+# at once by pydyf with versions that have not been checked
+PYDYF_STREAMING = _pydyf_supports_streaming()
+
+
+class PDFWriter:
+    """Incremental writer of PDF objects.
+
+    Objects are written as soon as they are complete, and the data of written
+    streams is released. Objects referenced before being complete (pages tree,
+    catalog, shared resources, fonts…) are written by :meth:`finish`, with the
+    cross-reference table and the trailer.
+
+    """
+    def __init__(self, pdf, output):
+        self._pdf = pdf
+        self._output = output
+        self._deferred = []
+        self._next_object = 0
+
+        # Write the header written by pydyf, everything before its first
+        # object
+        empty_pdf = pydyf.PDF()
+        empty_output = io.BytesIO()
+        empty_pdf.write(empty_output)
+        header = empty_output.getvalue()[:empty_pdf.objects[1].offset]
+        output.write(header)
+        pdf.current_position += len(header)
+
+    def defer(self):
+        """Keep the objects added since last call, they are not complete."""
+        self._deferred.extend(self._pdf.objects[self._next_object:])
+        self._next_object = len(self._pdf.objects)
+
+    def flush(self):
+        """Write the objects added since last call."""
+        for object_ in self._pdf.objects[self._next_object:]:
+            self._write_object(object_)
+        self._next_object = len(self._pdf.objects)
+
+    def _write_object(self, object_):
+        if object_.free == 'f':
+            return
+        object_.offset = self._pdf.current_position
+        self._pdf.write_line(object_.indirect, self._output)
+        if isinstance(object_, pydyf.Stream):
+            # Stream data is not needed anymore
+            object_.stream = []
+
+    def finish(self):
+        """Write remaining objects, cross-reference table and trailer."""
+        pdf, output = self._pdf, self._output
+        if pdf.info.number is None:
+            pdf.add_object(pdf.info)
+        for object_ in self._deferred:
+            self._write_object(object_)
+        self._deferred = []
+        self.flush()
+
+        pdf.xref_position = pdf.current_position
+        pdf.write_line(b'xref', output)
+        pdf.write_line(f'0 {len(pdf.objects)}'.encode(), output)
+        for object_ in pdf.objects:
+            pdf.write_line(
+                (f'{object_.offset:010} {object_.generation:05} '
+                 f'{object_.free} ').encode(), output)
+
+        pdf.write_line(b'trailer', output)
+        pdf.write_line(b'<<', output)
+        pdf.write_line(f'/Size {len(pdf.objects)}'.encode(), output)
+        pdf.write_line(b'/Root ' + pdf.catalog.reference, output)
+        pdf.write_line(b'/Info ' + pdf.info.reference, output)
+        pdf.write_line(b'>>', output)
+        pdf.write_line(b'startxref', output)
+        pdf.write_line(f'{pdf.xref_position}'.encode(), output)
+        pdf.write_line(b'%%EOF', output)
+
+
 BookmarkSubtree = collections.namedtuple(
     'BookmarkSubtree', ('label', 'destination', 'children', 'state'))
 
@@ -529,6 +549,67 @@ def add_hyperlinks(links, anchors, matrix, pdf, page, names):
             anchor_name, pydyf.Array([page.reference, '/XYZ', x, y, 0])])
 
 
+def _font_program_options(empty_glyphs):
+    """Return a description of the options used to build font programs."""
+    return (
+        f'fonttools {fontTools.version}, retain gids, no hinting, '
+        f'no GSUB and GPOS, empty glyphs {bool(empty_glyphs)}').encode()
+
+
+def _font_program(content, index, glyphs, empty_glyphs):
+    """Return the font file embedded in PDF files.
+
+    The font is subsetted to keep only ``glyphs``, a set of glyph ids, unless
+    ``glyphs`` is :obj:`None`. Glyphs are replaced by empty glyphs if
+    ``empty_glyphs`` is true, used for PNG and SVG emojis.
+
+    """
+    if glyphs is not None:
+        # Optimize font
+        full_font = io.BytesIO(content)
+        optimized_font = io.BytesIO()
+        try:
+            ttfont = TTFont(full_font, fontNumber=index)
+            options = subset.Options(
+                retain_gids=True, passthrough_tables=True,
+                ignore_missing_glyphs=True, hinting=False)
+            options.drop_tables += ['GSUB', 'GPOS']
+            subsetter = subset.Subsetter(options)
+            subsetter.populate(gids=glyphs)
+            subsetter.subset(ttfont)
+            ttfont.save(optimized_font)
+            content = optimized_font.getvalue()
+        except TTLibError:
+            LOGGER.warning('Unable to optimize font')
+
+    if empty_glyphs:
+        # Add empty glyphs instead of PNG or SVG emojis
+        full_font = io.BytesIO(content)
+        try:
+            ttfont = TTFont(full_font, fontNumber=index)
+            if 'loca' not in ttfont or 'glyf' not in ttfont:
+                ttfont['loca'] = ttFont.getTableClass('loca')()
+                ttfont['glyf'] = ttFont.getTableClass('glyf')()
+                ttfont['glyf'].glyphOrder = ttfont.getGlyphOrder()
+                ttfont['glyf'].glyphs = {
+                    name: ttFont.getTableModule('glyf').Glyph()
+                    for name in ttfont['glyf'].glyphOrder}
+            else:
+                for glyph in ttfont['glyf'].glyphs:
+                    ttfont['glyf'][glyph] = (
+                        ttFont.getTableModule('glyf').Glyph())
+            for table_name in ('CBDT', 'CBLC', 'SVG '):
+                if table_name in ttfont:
+                    del ttfont[table_name]
+            output_font = io.BytesIO()
+            ttfont.save(output_font)
+            content = output_font.getvalue()
+        except TTLibError:
+            LOGGER.warning('Unable to save emoji font')
+
+    return content
+
+
 def rectangle_aabb(matrix, pos_x, pos_y, width, height):
     """Apply a transformation matrix to an axis-aligned rectangle.
 
@@ -872,7 +953,8 @@ class Document:
     def _build_layout_context(cls, html, stylesheets,
                               presentational_hints=False,
                               optimize_size=('fonts',), font_config=None,
-                              counter_style=None, image_cache=None):
+                              counter_style=None, image_cache=None,
+                              cache=None):
         if font_config is None:
             font_config = FontConfiguration()
         if counter_style is None:
@@ -896,32 +978,51 @@ class Document:
         PROGRESS_LOGGER.info('Step 4 - Creating formatting structure')
         context = LayoutContext(
             style_for, get_image_from_uri, font_config, counter_style,
-            target_collector)
+            target_collector, cache)
         return context
 
     @classmethod
-    def _render(cls, html, stylesheets, presentational_hints=False,
-                optimize_size=('fonts',), font_config=None, counter_style=None,
-                image_cache=None):
+    def _render_pages(cls, html, stylesheets, presentational_hints=False,
+                      optimize_size=('fonts',), font_config=None,
+                      counter_style=None, image_cache=None, cache=None,
+                      executor=None):
         if font_config is None:
             font_config = FontConfiguration()
 
         if counter_style is None:
             counter_style = CounterStyle()
 
+        if isinstance(executor, ThreadPoolExecutor):
+            # Fetch external resources in parallel, before they are needed.
+            # URL fetchers and fetched resources may not be picklable, they
+            # are only given to executors using threads.
+            html = copy.copy(html)
+            html.url_fetcher = prefetch_resources(html, executor)
+
         context = cls._build_layout_context(
             html, stylesheets, presentational_hints, optimize_size,
-            font_config, counter_style, image_cache)
+            font_config, counter_style, image_cache, cache)
 
         root_box = build_formatting_structure(
             html.etree_element, context.style_for, context.get_image_from_uri,
             html.base_url, context.target_collector, counter_style,
             context.footnotes)
 
-        page_boxes = layout_document(html, root_box, context)
+        for page_box in layout_document(html, root_box, context):
+            yield Page(page_box)
+
+    @classmethod
+    def _render(cls, html, stylesheets, presentational_hints=False,
+                optimize_size=('fonts',), font_config=None, counter_style=None,
+                image_cache=None, cache=None, executor=None):
+        if font_config is None:
+            font_config = FontConfiguration()
+
+        pages = cls._render_pages(
+            html, stylesheets, presentational_hints, optimize_size,
+            font_config, counter_style, image_cache, cache, executor)
         rendering = cls(
-            [Page(page_box) for page_box in page_boxes],
-            DocumentMetadata(**get_html_metadata(html)),
+            list(pages), DocumentMetadata(**get_html_metadata(html)),
             html.url_fetcher, font_config, optimize_size)
         return rendering
 
@@ -934,11 +1035,19 @@ class Document:
         return resources.reference
 
     def _use_references(self, pdf, resources, images):
+        # Resources already replaced by references are ignored, so that this
+        # method can be called again when new resources are added
         # XObjects
         for key, x_object in resources.get('XObject', {}).items():
+            if isinstance(x_object, bytes):
+                continue
+
             # Images
             if x_object is None:
                 x_object = images[key]
+                if isinstance(x_object, Future):
+                    # Image encoded in parallel
+                    x_object = images[key] = x_object.result()[0]
                 if x_object.number is not None:
                     # Image already added to PDF
                     resources['XObject'][key] = x_object.reference
@@ -960,6 +1069,8 @@ class Document:
 
         # Patterns
         for key, pattern in resources.get('Pattern', {}).items():
+            if isinstance(pattern, bytes):
+                continue
             pdf.add_object(pattern)
             resources['Pattern'][key] = pattern.reference
             if 'Resources' in pattern.extra:
@@ -968,13 +1079,16 @@ class Document:
 
         # Shadings
         for key, shading in resources.get('Shading', {}).items():
+            if isinstance(shading, bytes):
+                continue
             pdf.add_object(shading)
             resources['Shading'][key] = shading.reference
 
         # Alpha states
         for key, alpha in resources.get('ExtGState', {}).items():
             if 'SMask' in alpha and 'G' in alpha['SMask']:
-                alpha['SMask']['G'] = alpha['SMask']['G'].reference
+                if not isinstance(alpha['SMask']['G'], bytes):
+                    alpha['SMask']['G'] = alpha['SMask']['G'].reference
 
     def __init__(self, pages, metadata, url_fetcher, font_config,
                  optimize_size):
@@ -1093,7 +1207,8 @@ class Document:
             last_by_depth.append(children)
         return previous_level
 
-    def write_pdf(self, target=None, zoom=1, attachments=None, finisher=None):
+    def write_pdf(self, target=None, zoom=1, attachments=None, finisher=None,
+                  font_cache=None, executor=None):
         """Paint the pages in a PDF file, with metadata.
 
         :type target:
@@ -1113,12 +1228,37 @@ class Document:
         :param finisher: A finisher function, that accepts the document and a
             :class:`pydyf.PDF` object as parameters, can be passed to perform
             post-processing on the PDF right before the trailer is written.
+            When no finisher is given, pages are written to ``target`` as soon
+            as they are painted, and their content is released.
+        :type font_cache: :class:`text.fonts.FontSubsetCache`
+        :param font_cache:
+            A cache storing subsetted fonts between documents, or :obj:`None`.
+        :type executor: :class:`concurrent.futures.Executor`
+        :param executor:
+            An executor used to subset fonts and encode images in parallel, or
+            :obj:`None`. The generated PDF is the same with or without
+            executor.
         :returns:
             The PDF as :obj:`bytes` if ``target`` is not provided or
             :obj:`None`, otherwise :obj:`None` (the PDF is written to
             ``target``).
 
         """
+        if target is None:
+            output = io.BytesIO()
+            self._write_pdf(
+                output, zoom, attachments, finisher, font_cache, executor)
+            return output.getvalue()
+        elif hasattr(target, 'write'):
+            self._write_pdf(
+                target, zoom, attachments, finisher, font_cache, executor)
+        else:
+            with open(target, 'wb') as output:
+                self._write_pdf(
+                    output, zoom, attachments, finisher, font_cache, executor)
+
+    def _write_pdf(self, output, zoom, attachments, finisher, font_cache,
+                   executor):
         # 0.75 = 72 PDF point per inch / 96 CSS pixel per inch
         scale = zoom * 0.75
 
@@ -1137,6 +1277,9 @@ class Document:
             'Shading': shadings,
         })
         pdf.add_object(resources)
+        pdf_fonts = pydyf.Dictionary()
+        pdf.add_object(pdf_fonts)
+        resources['Font'] = pdf_fonts.reference
         pdf_names = []
 
         # Links and anchors
@@ -1152,7 +1295,8 @@ class Document:
         # embedded URL and reuse the object number.
         for page_links in attachment_links:
             for link_type, annot_target, rectangle, _ in page_links:
-                if link_type == 'attachment' and target not in annot_files:
+                if (link_type == 'attachment' and
+                        annot_target not in annot_files):
                     # TODO: Use the title attribute as description. The comment
                     # above about multiple regions won't always be correct,
                     # because two links might have the same href, but different
@@ -1160,6 +1304,15 @@ class Document:
                     annot_files[annot_target] = _write_pdf_attachment(
                         pdf, (annot_target, None), self.url_fetcher)
 
+        # With a finisher, all the objects can be modified until the end.
+        # Otherwise, objects are written as soon as they are complete, when
+        # the installed version of pydyf is supported.
+        writer = (
+            PDFWriter(pdf, output)
+            if PYDYF_STREAMING and not finisher else None)
+        if writer:
+            writer.defer()
+
         # Bookmarks
         root = []
         # At one point in the document, for each "output" depth, how much
@@ -1192,7 +1345,7 @@ class Document:
                 (right - left) / scale, (bottom - top) / scale)
             stream = Stream(
                 self, page_rectangle, states, x_objects, patterns, shadings,
-                images)
+                images, executor=executor)
             stream.transform(d=-1, f=(page.height * scale))
             page.paint(stream, scale=scale)
             pdf.add_object(stream)
@@ -1265,6 +1418,11 @@ class Document:
                 page, skipped_levels, last_by_depth, previous_level,
                 page_number, matrix)
 
+            if writer:
+                # Write the page and the resources it has added
+                self._use_references(pdf, resources, images)
+                writer.flush()
+
         # Outlines
         outlines, count = create_bookmarks(root, pdf)
         if outlines:
@@ -1320,7 +1478,6 @@ class Document:
             pdf.catalog['Names']['EmbeddedFiles'] = content.reference
 
         # Embeded fonts
-        pdf_fonts = pydyf.Dictionary()
         fonts_by_file_hash = {}
         for font in self.fonts.values():
             if font.file_hash in fonts_by_file_hash:
@@ -1328,54 +1485,40 @@ class Document:
             else:
                 fonts_by_file_hash[font.file_hash] = [font]
         font_references_by_file_hash = {}
+        font_programs = {}
         for file_hash, fonts in fonts_by_file_hash.items():
             content = fonts[0].file_content
-
+            index = fonts[0].index
+            empty_glyphs = fonts[0].png or fonts[0].svg
             if 'fonts' in self._optimize_size:
-                # Optimize font
-                cmap = {}
+                glyphs = set()
                 for font in fonts:
-                    cmap = {**cmap, **font.cmap}
-                full_font = io.BytesIO(content)
-                optimized_font = io.BytesIO()
-                try:
-                    ttfont = TTFont(full_font, fontNumber=fonts[0].index)
-                    options = subset.Options(
-                        retain_gids=True, passthrough_tables=True,
-                        ignore_missing_glyphs=True, hinting=False)
-                    options.drop_tables += ['GSUB', 'GPOS']
-                    subsetter = subset.Subsetter(options)
-                    subsetter.populate(gids=cmap)
-                    subsetter.subset(ttfont)
-                    ttfont.save(optimized_font)
-                    content = optimized_font.getvalue()
-                except TTLibError:
-                    LOGGER.warning('Unable to optimize font')
-
-            if fonts[0].png or fonts[0].svg:
-                # Add empty glyphs instead of PNG or SVG emojis
-                full_font = io.BytesIO(content)
-                try:
-                    ttfont = TTFont(full_font, fontNumber=fonts[0].index)
-                    if 'loca' not in ttfont or 'glyf' not in ttfont:
-                        ttfont['loca'] = ttFont.getTableClass('loca')()
-                        ttfont['glyf'] = ttFont.getTableClass('glyf')()
-                        ttfont['glyf'].glyphOrder = ttfont.getGlyphOrder()
-                        ttfont['glyf'].glyphs = {
-                            name: ttFont.getTableModule('glyf').Glyph()
-                            for name in ttfont['glyf'].glyphOrder}
-                    else:
-                        for glyph in ttfont['glyf'].glyphs:
-                            ttfont['glyf'][glyph] = (
-                                ttFont.getTableModule('glyf').Glyph())
-                    for table_name in ('CBDT', 'CBLC', 'SVG '):
-                        if table_name in ttfont:
-                            del ttfont[table_name]
-                    output_font = io.BytesIO()
-                    ttfont.save(output_font)
-                    content = output_font.getvalue()
-                except TTLibError:
-                    LOGGER.warning('Unable to save emoji font')
+                    glyphs.update(font.cmap)
+            else:
+                glyphs = None
+
+            key = None
+            if font_cache is not None:
+                key = font_cache.key(
+                    content, index, glyphs,
+                    _font_program_options(empty_glyphs))
+                cached_content = font_cache.get(key)
+                if cached_content is not None:
+                    font_programs[file_hash] = None, cached_content
+                    continue
+            if executor is None:
+                content = _font_program(content, index, glyphs, empty_glyphs)
+            else:
+                # Subsetted in parallel, future replaced below
+                content = executor.submit(
+                    _font_program, content, index, glyphs, empty_glyphs)
+            font_programs[file_hash] = key, content
+
+        for file_hash, (key, content) in font_programs.items():
+            if isinstance(content, Future):
+                content = content.result()
+            if key is not None:
+                font_cache.set(key, content)
 
             # Include font
             font_type = 'otf' if content[:4] == b'OTTO' else 'ttf'
@@ -1465,8 +1608,6 @@ class Document:
             pdf.add_object(font_dictionary)
             pdf_fonts[font.hash] = font_dictionary.reference
 
-        pdf.add_object(pdf_fonts)
-        resources['Font'] = pdf_fonts.reference
         self._use_references(pdf, resources, images)
 
         # Anchors
@@ -1479,18 +1620,9 @@ class Document:
             pdf.catalog['Names'] = pydyf.Dictionary(
                 {'Dests': pydyf.Dictionary({'Names': name_array})})
 
-        if finisher:
-            finisher(self, pdf)
-
-        file_obj = io.BytesIO()
-        pdf.write(file_obj)
-
-        if target is None:
-            return file_obj.getvalue()
+        if writer:
+            writer.finish()
         else:
-            file_obj.seek(0)
-            if hasattr(target, 'write'):
-                shutil.copyfileobj(file_obj, target)
-            else:
-                with open(target, 'wb') as fd:
-                    shutil.copyfileobj(file_obj, fd)
+            if finisher:
+                finisher(self, pdf)
+            pdf.write(output)
@@ -15,7 +15,7 @@ from .layout import replaced
 from .layout.background import BackgroundLayer
 from .stacking import StackingContext
 from .text.ffi import ffi, harfbuzz, pango, units_from_double, units_to_double
-from .text.line_break import get_last_word_end
+from .text.line_break import get_glyph_runs, get_last_word_end
 
 SIDES = ('top', 'right', 'bottom', 'left')
 
@@ -983,7 +983,6 @@ def draw_text(stream, textbox, offset_x, text_overflow, block_ellipsis):
     stream.set_color_rgb(*textbox.style['color'][:3])
     stream.set_alpha(textbox.style['color'][3])
 
-    textbox.pango_layout.reactivate(textbox.style)
     stream.begin_text()
     emojis = draw_first_line(
         stream, textbox, text_overflow, block_ellipsis, x, y)
@@ -1013,8 +1012,6 @@ def draw_text(stream, textbox, offset_x, text_overflow, block_ellipsis):
         draw_text_decoration(
             stream, textbox, offset_x, offset_y, thickness, color)
 
-    textbox.pango_layout.deactivate()
-
 
 def draw_emojis(stream, font_size, x, y, emojis):
     for emoji in emojis:
@@ -1030,56 +1027,60 @@ def draw_first_line(stream, textbox, text_overflow, block_ellipsis, x, y,
     """Draw the given ``textbox`` line to the document ``stream``."""
     from .document import Matrix
 
-    pango.pango_layout_set_single_paragraph_mode(
-        textbox.pango_layout.layout, True)
-
-    if text_overflow == 'ellipsis' or block_ellipsis != 'none':
-        assert textbox.pango_layout.max_width is not None
-        max_width = textbox.pango_layout.max_width
-        pango.pango_layout_set_width(
-            textbox.pango_layout.layout, units_from_double(max_width))
-        if text_overflow == 'ellipsis':
-            pango.pango_layout_set_ellipsize(
-                textbox.pango_layout.layout, pango.PANGO_ELLIPSIZE_END)
-        else:
-            if block_ellipsis == 'auto':
-                ellipsis = '…'
+    ellipsize = text_overflow == 'ellipsis' or block_ellipsis != 'none'
+    reactivate = ellipsize or textbox.pango_layout.glyph_runs is None
+    if reactivate:
+        textbox.pango_layout.reactivate(textbox.style)
+        pango.pango_layout_set_single_paragraph_mode(
+            textbox.pango_layout.layout, True)
+
+        if ellipsize:
+            assert textbox.pango_layout.max_width is not None
+            max_width = textbox.pango_layout.max_width
+            pango.pango_layout_set_width(
+                textbox.pango_layout.layout, units_from_double(max_width))
+            if text_overflow == 'ellipsis':
+                pango.pango_layout_set_ellipsize(
+                    textbox.pango_layout.layout, pango.PANGO_ELLIPSIZE_END)
             else:
-                assert block_ellipsis[0] == 'string'
-                ellipsis = block_ellipsis[1]
+                if block_ellipsis == 'auto':
+                    ellipsis = '…'
+                else:
+                    assert block_ellipsis[0] == 'string'
+                    ellipsis = block_ellipsis[1]
 
-            # Remove last word if hyphenated
-            new_text = textbox.pango_layout.text
-            if new_text.endswith(textbox.style['hyphenate_character']):
-                last_word_end = get_last_word_end(
-                    new_text[:-len(textbox.style['hyphenate_character'])],
-                    textbox.style['lang'])
-                if last_word_end:
-                    new_text = new_text[:last_word_end]
+                # Remove last word if hyphenated
+                new_text = textbox.pango_layout.text
+                if new_text.endswith(textbox.style['hyphenate_character']):
+                    last_word_end = get_last_word_end(
+                        new_text[:-len(textbox.style['hyphenate_character'])],
+                        textbox.style['lang'])
+                    if last_word_end:
+                        new_text = new_text[:last_word_end]
 
-            textbox.pango_layout.set_text(new_text + ellipsis)
+                textbox.pango_layout.set_text(new_text + ellipsis)
 
-    first_line, index = textbox.pango_layout.get_first_line()
+        first_line, index = textbox.pango_layout.get_first_line()
 
-    if block_ellipsis != 'none':
-        while index:
-            last_word_end = get_last_word_end(
-                textbox.pango_layout.text[:-len(ellipsis)],
-                textbox.style['lang'])
-            if last_word_end is None:
-                break
-            new_text = textbox.pango_layout.text[:last_word_end]
-            textbox.pango_layout.set_text(new_text + ellipsis)
-            first_line, index = textbox.pango_layout.get_first_line()
+        if block_ellipsis != 'none':
+            while index:
+                last_word_end = get_last_word_end(
+                    textbox.pango_layout.text[:-len(ellipsis)],
+                    textbox.style['lang'])
+                if last_word_end is None:
+                    break
+                new_text = textbox.pango_layout.text[:last_word_end]
+                textbox.pango_layout.set_text(new_text + ellipsis)
+                first_line, index = textbox.pango_layout.get_first_line()
+        runs = get_glyph_runs(first_line)
+    else:
+        # Use glyphs kept during layout, text doesn't have to be shaped again
+        runs = textbox.pango_layout.glyph_runs
 
     font_size = textbox.style['font_size']
     utf8_text = textbox.pango_layout.text.encode()
     previous_utf8_position = 0
 
-    runs = [first_line.runs[0]]
-    while runs[-1].next != ffi.NULL:
-        runs.append(runs[-1].next)
-
     matrix = Matrix(font_size, 0, 0, -font_size, x, y)
     if angle:
         matrix = Matrix(a=cos(angle), b=-sin(angle),
@@ -1091,16 +1092,13 @@ def draw_first_line(stream, textbox, text_overflow, block_ellipsis, x, y,
     x_advance = 0
     emojis = []
     for run in runs:
-        # Pango objects
-        glyph_item = ffi.cast('PangoGlyphItem *', run.data)
-        glyph_string = glyph_item.glyphs
-        glyphs = glyph_string.glyphs
-        num_glyphs = glyph_string.num_glyphs
-        offset = glyph_item.item.offset
-        clusters = glyph_string.log_clusters
+        glyphs = run.glyphs
+        num_glyphs = run.num_glyphs
+        offset = run.offset
+        clusters = run.clusters
 
         # Font content
-        pango_font = glyph_item.item.analysis.font
+        pango_font = run.font
         hb_font = pango.pango_font_get_hb_font(pango_font)
         hb_face = harfbuzz.hb_font_get_face(hb_font)
         font_hash = hash(hb_face)
@@ -1117,7 +1115,7 @@ def draw_first_line(stream, textbox, text_overflow, block_ellipsis, x, y,
 
         # Positions of the glyphs in the UTF-8 string
         utf8_positions = [offset + clusters[i] for i in range(1, num_glyphs)]
-        utf8_positions.append(offset + glyph_item.item.length)
+        utf8_positions.append(offset + run.length)
 
         # Go through the run glyphs
         if font != last_font:
@@ -1220,6 +1218,9 @@ def draw_first_line(stream, textbox, text_overflow, block_ellipsis, x, y,
     # Draw text
     stream.show_text(string)
 
+    if reactivate:
+        textbox.pango_layout.deactivate()
+
     return emojis
 
 
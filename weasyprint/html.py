@@ -7,28 +7,108 @@ are images with intrinsic dimensions.
 
 """
 
+import hashlib
+import os
+import pickle
 import re
+import sys
+import tempfile
+from functools import lru_cache
+from pathlib import Path
 from pkgutil import get_data
 from urllib.parse import urljoin
 
-from . import CSS
-from .css import get_child_text
+import cssselect2
+import html5lib
+import tinycss2
+
+from . import CSS, __version__
+from .css import PicklableMatcher, get_child_text, media_queries
 from .css.counters import CounterStyle
+from .css.utils import find_urls
 from .formatting_structure import boxes
 from .images import SVGImage
 from .logger import LOGGER
-from .urls import get_url_attribute
+from .urls import PrefetchingURLFetcher, get_url_attribute
+
+
+def _get_ua_stylesheets_cache_path(ua, ph):
+    """Get the path of the file storing the preprocessed UA stylesheets.
+
+    Return ``None`` when the ``WEASYPRINT_CACHE_DIR`` environment variable is
+    not set.
+
+    """
+    cache_folder = os.environ.get('WEASYPRINT_CACHE_DIR')
+    if not cache_folder:
+        return None
+    key = hashlib.sha256()
+    for part in (
+            __version__, getattr(cssselect2, '__version__', ''),
+            getattr(tinycss2, '__version__', ''), sys.version, ua, ph):
+        key.update(part if isinstance(part, bytes) else part.encode())
+    return Path(cache_folder) / f'ua-{key.hexdigest()}.pickle'
+
+
+def _build_ua_stylesheets(ua, ph):
+    """Parse and validate the counter styles and stylesheets."""
+    counter_style = CounterStyle()
+    ua_stylesheet = CSS(
+        string=ua.decode(), counter_style=counter_style,
+        matcher=PicklableMatcher())
+    ph_stylesheet = CSS(string=ph.decode(), matcher=PicklableMatcher())
+    return counter_style, ua_stylesheet, ph_stylesheet
+
+
+def _load_ua_stylesheets(ua, ph):
+    """Get the counter styles and the stylesheets of the user agent.
+
+    Parsing and validating the stylesheets is slow. When the
+    ``WEASYPRINT_CACHE_DIR`` environment variable is set, they are
+    preprocessed once and stored in a cache file in this folder. This file
+    depends on the stylesheets and on the versions of WeasyPrint, Python and
+    CSS libraries. Files are never removed, as other versions may use them.
+
+    Cache files are loaded with :mod:`pickle`, this folder must only be
+    writable by trusted users.
+
+    """
+    path = None
+    try:
+        path = _get_ua_stylesheets_cache_path(ua, ph)
+        if path is not None:
+            with path.open('rb') as fd:
+                return pickle.load(fd)
+    except Exception:
+        # Missing, unreadable or obsolete cache file
+        pass
+
+    stylesheets = _build_ua_stylesheets(ua, ph)
+    if path is None:
+        return stylesheets
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write in a temporary file first, so that other processes never read
+        # partially written files
+        file_descriptor, filename = tempfile.mkstemp(
+            dir=path.parent, suffix='.tmp')
+        with open(file_descriptor, 'wb') as fd:
+            pickle.dump(stylesheets, fd)
+        os.replace(filename, path)
+    except OSError:
+        LOGGER.debug('User agent stylesheets could not be cached in %s', path)
+    return stylesheets
+
 
-HTML5_UA_COUNTER_STYLE = CounterStyle()
 HTML5_UA = get_data('weasyprint', 'css/html5_ua.css')
 HTML5_PH = get_data('weasyprint', 'css/html5_ph.css')
 if HTML5_UA is None:
     LOGGER.warning('User agent stylesheet could not be loaded')
+    HTML5_UA_COUNTER_STYLE = CounterStyle()
     HTML5_UA_STYLESHEET = HTML5_PH_STYLESHEET = CSS(string='')
 else:
-    HTML5_UA_STYLESHEET = CSS(
-        string=HTML5_UA.decode(), counter_style=HTML5_UA_COUNTER_STYLE)
-    HTML5_PH_STYLESHEET = CSS(string=HTML5_PH.decode())
+    HTML5_UA_COUNTER_STYLE, HTML5_UA_STYLESHEET, HTML5_PH_STYLESHEET = (
+        _load_ua_stylesheets(HTML5_UA, HTML5_PH))
 
 # http://whatwg.org/C#space-character
 HTML_WHITESPACE = ' \t\n\f\r'
@@ -267,6 +347,68 @@ def handle_svg(element, box, get_image_from_uri, base_url):
         return [make_replaced_box(element, box, image)]
 
 
+def parse_html5lib(source, encoding=None, protocol_encoding=None):
+    """Parse HTML with html5lib.
+
+    :param source: A string, bytes or a :term:`file object`.
+    :param str encoding: Force the source character encoding.
+    :param str protocol_encoding: The encoding given by the transport layer,
+        for example in HTTP headers.
+    :returns: The root element of an :mod:`xml.etree.ElementTree` tree.
+
+    """
+    if isinstance(source, str):
+        return html5lib.parse(source, namespaceHTMLElements=False)
+    else:
+        return html5lib.parse(
+            source, override_encoding=encoding,
+            transport_encoding=protocol_encoding,
+            namespaceHTMLElements=False)
+
+
+@lru_cache(maxsize=None)
+def _import_html5_parser():
+    """Import html5-parser, warn only once if it's not installed."""
+    try:
+        import html5_parser
+    except ImportError:
+        LOGGER.warning('html5-parser is not installed, html5lib is used')
+        return None
+    return html5_parser
+
+
+def parse_html5_parser(source, encoding=None, protocol_encoding=None):
+    """Parse HTML with html5-parser, or with html5lib if it's not installed.
+
+    html5-parser is a fast HTML5 parser written in C. It gives the same tree
+    as html5lib, but is much faster for large documents.
+
+    The parameters and the returned value are the same as
+    :func:`parse_html5lib`.
+
+    """
+    html5_parser = _import_html5_parser()
+    if html5_parser is None:
+        return parse_html5lib(source, encoding, protocol_encoding)
+
+    if hasattr(source, 'read'):
+        source = source.read()
+    if isinstance(source, bytes) and encoding is not None:
+        source = source.decode(encoding, 'replace')
+    root = html5_parser.parse(
+        source, transport_encoding=protocol_encoding,
+        namespace_elements=True, treebuilder='etree', keep_doctype=False)
+
+    # Keep namespaces of foreign elements like html5lib does, remove the
+    # XHTML namespace
+    xhtml_namespace = '{http://www.w3.org/1999/xhtml}'
+    for element in root.iter():
+        tag = element.tag
+        if isinstance(tag, str) and tag.startswith(xhtml_namespace):
+            element.tag = tag[len(xhtml_namespace):]
+    return root
+
+
 def find_base_url(html_document, fallback_base_url):
     """Return the base URL for the document.
 
@@ -335,6 +477,61 @@ def get_html_metadata(html):
                 attachments=attachments)
 
 
+def prefetch_resources(html, executor):
+    """Fetch the external resources used by the document in parallel.
+
+    Stylesheets, images, objects and fonts referenced by the HTML tree and by
+    the stylesheets are fetched by ``executor``.
+
+    Return a URL fetcher returning the prefetched resources.
+
+    """
+    def prefetch_stylesheet_resources(url, result):
+        if result.get('mime_type') == 'text/css':
+            if isinstance(result['string'], str):
+                rules = tinycss2.parse_stylesheet(result['string'])
+            else:
+                rules, _ = tinycss2.parse_stylesheet_bytes(
+                    result['string'],
+                    protocol_encoding=result.get('encoding'))
+            base_url = result.get('redirected_url', url)
+            for resource_url in find_urls(rules, base_url):
+                url_fetcher.prefetch(resource_url)
+
+    url_fetcher = PrefetchingURLFetcher(
+        html.url_fetcher, executor, prefetch_stylesheet_resources)
+    base_url = html.base_url
+    for element in html.etree_element.iter():
+        if not isinstance(element.tag, str):
+            # Comments and processing instructions
+            continue
+        urls = []
+        if element.tag == 'img':
+            urls.append(get_url_attribute(element, 'src', base_url))
+        elif element.tag == 'embed':
+            urls.append(get_url_attribute(element, 'src', base_url))
+        elif element.tag == 'object':
+            urls.append(get_url_attribute(element, 'data', base_url))
+        elif element.tag == 'link':
+            media = element.get('media', '').strip() or 'all'
+            media = [media_type.strip() for media_type in media.split(',')]
+            if element_has_link_type(element, 'stylesheet') and (
+                    media_queries.evaluate_media_query(
+                        media, html.media_type)):
+                urls.append(get_url_attribute(element, 'href', base_url))
+        elif element.tag == 'style':
+            rules = tinycss2.parse_stylesheet(get_child_text(element))
+            urls.extend(find_urls(rules, base_url))
+        if element.get('style'):
+            declarations = tinycss2.parse_declaration_list(
+                element.get('style'))
+            urls.extend(find_urls(declarations, base_url))
+        for url in urls:
+            if url is not None:
+                url_fetcher.prefetch(url)
+    return url_fetcher
+
+
 def strip_whitespace(string):
     """Use the HTML definition of "space character",
     not all Unicode Whitespace.
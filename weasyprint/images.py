@@ -1,7 +1,11 @@
 """Fetch and decode images in various formats."""
 
+import copy
+import hashlib
 import math
-from io import BytesIO
+import struct
+from collections import OrderedDict
+from io import SEEK_CUR, BytesIO
 from itertools import cycle
 from math import inf
 from xml.etree import ElementTree
@@ -29,16 +33,183 @@ class ImageLoadingError(ValueError):
         return cls(f'{name}: {value}' if value else name)
 
 
+def _get_idat_data(image_file):
+    """Return the header data and the compressed image data of a PNG file."""
+    # Read the PNG signature, then discard it because we know it's a PNG.
+    image_file.seek(8)
+
+    header = None
+    png_data = b''
+    raw_chunk_length = image_file.read(4)
+    # PNG files consist of a series of chunks.
+    while len(raw_chunk_length) > 0:
+        # Each chunk begins with its data length (four bytes, may be zero),
+        # then its type (four ASCII characters), then the data, then four
+        # bytes of a CRC.
+        chunk_len, = struct.unpack('!I', raw_chunk_length)
+        chunk_type = image_file.read(4)
+        if chunk_type == b'IDAT':
+            png_data += image_file.read(chunk_len)
+        elif chunk_type == b'IHDR':
+            header = image_file.read(chunk_len)
+        else:
+            image_file.seek(chunk_len, SEEK_CUR)
+        # We aren't checking the CRC, we assume this is a valid PNG.
+        image_file.seek(4, SEEK_CUR)
+        raw_chunk_length = image_file.read(4)
+
+    return header, png_data
+
+
+def _get_png_data(pillow_image, optimize):
+    """Return the compressed data of a PNG image, without its chunks."""
+    image_file = BytesIO()
+    pillow_image.save(image_file, format='PNG', optimize=optimize)
+    return _get_idat_data(image_file)[1]
+
+
+def _get_original_png_data(image_data):
+    """Return the compressed data of an original PNG file, or :obj:`None`.
+
+    Only data of non-interlaced 8-bit RGB or grayscale images can be directly
+    included in PDF files, other images have to be decoded.
+
+    """
+    header, png_data = _get_idat_data(BytesIO(image_data))
+    if header is None or len(header) != 13:
+        return
+    bit_depth, color_type, _, _, interlace = header[8:]
+    if bit_depth == 8 and color_type in (0, 2) and interlace == 0:
+        return png_data
+
+
+def _image_x_object(pillow_image, interpolate, optimize, image_data=None):
+    """Return the PDF image XObject of a Pillow image.
+
+    ``image_data`` is the content of the original image file, or :obj:`None`.
+    When possible, JPEG and JPEG 2000 files and PNG compressed data are
+    directly included, without being decoded and encoded again.
+
+    This function may be called in a worker thread or process.
+
+    """
+    if 'transparency' in pillow_image.info:
+        pillow_image = pillow_image.convert('RGBA')
+    elif pillow_image.mode in ('1', 'P', 'I'):
+        pillow_image = pillow_image.convert('RGB')
+
+    if pillow_image.mode in ('RGB', 'RGBA'):
+        color_space = '/DeviceRGB'
+    elif pillow_image.mode in ('L', 'LA'):
+        color_space = '/DeviceGray'
+    elif pillow_image.mode == 'CMYK':
+        color_space = '/DeviceCMYK'
+    else:
+        LOGGER.warning('Unknown image mode: %s', pillow_image.mode)
+        color_space = '/DeviceRGB'
+
+    extra = pydyf.Dictionary({
+        'Type': '/XObject',
+        'Subtype': '/Image',
+        'Width': pillow_image.width,
+        'Height': pillow_image.height,
+        'ColorSpace': color_space,
+        'BitsPerComponent': 8,
+        'Interpolate': interpolate,
+    })
+
+    # Original files are included as-is when their color space is supported
+    # by PDF, unless images are optimized
+    passthrough = (
+        image_data is not None and not optimize and
+        pillow_image.mode in ('RGB', 'L'))
+    if passthrough and pillow_image.format == 'JPEG':
+        extra['Filter'] = '/DCTDecode'
+        stream = [image_data]
+    elif (passthrough and pillow_image.format == 'JPEG2000' and
+            getattr(pillow_image, 'codec', None) == 'jp2'):
+        # Bits per component are given by the JPX file
+        extra['Filter'] = '/JPXDecode'
+        del extra['BitsPerComponent']
+        stream = [image_data]
+    elif pillow_image.format == 'JPEG':
+        extra['Filter'] = '/DCTDecode'
+        image_file = BytesIO()
+        pillow_image.save(image_file, format='JPEG', optimize=optimize)
+        stream = [image_file.getvalue()]
+    else:
+        extra['Filter'] = '/FlateDecode'
+        extra['DecodeParms'] = pydyf.Dictionary({
+            # Predictor 15 specifies that we're providing PNG data,
+            # ostensibly using an "optimum predictor", but doesn't actually
+            # matter as long as the predictor value is 10+ according to the
+            # spec. (Other PNG predictor values assert that we're using
+            # specific predictors that we don't want to commit to, but
+            # "optimum" can vary.)
+            'Predictor': 15,
+            'Columns': pillow_image.width,
+        })
+        if pillow_image.mode in ('RGB', 'RGBA'):
+            # Defaults to 1.
+            extra['DecodeParms']['Colors'] = 3
+        png_data = None
+        if passthrough and pillow_image.format == 'PNG':
+            # Use the original compressed data without decoding the pixels
+            png_data = _get_original_png_data(image_data)
+        if png_data is None:
+            if pillow_image.mode in ('RGBA', 'LA'):
+                alpha = pillow_image.getchannel('A')
+                pillow_image = pillow_image.convert(pillow_image.mode[:-1])
+                alpha_data = _get_png_data(alpha, optimize)
+                extra['SMask'] = pydyf.Stream([alpha_data], extra={
+                    'Filter': '/FlateDecode',
+                    'Type': '/XObject',
+                    'Subtype': '/Image',
+                    'DecodeParms': pydyf.Dictionary({
+                        'Predictor': 15,
+                        'Columns': pillow_image.width,
+                    }),
+                    'Width': pillow_image.width,
+                    'Height': pillow_image.height,
+                    'ColorSpace': '/DeviceGray',
+                    'BitsPerComponent': 8,
+                    'Interpolate': interpolate,
+                    })
+            png_data = _get_png_data(pillow_image, optimize)
+        stream = [png_data]
+
+    return pydyf.Stream(stream, extra=extra)
+
+
 class RasterImage:
-    def __init__(self, pillow_image, image_id, optimize_size):
+    def __init__(self, pillow_image, image_id, optimize_size, image_data=None):
         pillow_image.id = image_id
+        self.id = image_id
         self._pillow_image = pillow_image
+        # Original file, included as-is in PDF when possible
+        self._image_data = image_data
         self._optimize_size = optimize_size
         self._intrinsic_width = pillow_image.width
         self._intrinsic_height = pillow_image.height
         self._intrinsic_ratio = (
             self._intrinsic_width / self._intrinsic_height
             if self._intrinsic_height != 0 else inf)
+        # PDF XObjects, kept to be reused by other documents
+        self._x_objects = {}
+
+    @property
+    def memory_size(self):
+        """Estimated size of the image in memory, in bytes."""
+        # Original data and decoded image
+        size = len(self._image_data or b'') + (
+            self._intrinsic_width * self._intrinsic_height *
+            len(self._pillow_image.getbands()))
+        for x_object in list(self._x_objects.values()):
+            size += sum(len(data) for data in x_object.stream)
+            if 'SMask' in x_object.extra:
+                size += sum(
+                    len(data) for data in x_object.extra['SMask'].stream)
+        return size
 
     def get_intrinsic_size(self, image_resolution, font_size):
         return (
@@ -46,23 +217,56 @@ class RasterImage:
             self._intrinsic_height / image_resolution,
             self._intrinsic_ratio)
 
+    def has_x_object(self, interpolate):
+        """Whether this image has already been encoded."""
+        return interpolate in self._x_objects
+
+    def set_x_object(self, interpolate, x_object):
+        """Keep an XObject of this image encoded in another process."""
+        self._x_objects.setdefault(interpolate, x_object)
+
+    def get_x_object(self, interpolate):
+        """Get a new PDF XObject for this image.
+
+        The image is encoded once, the XObjects returned by following calls
+        share the same data.
+
+        """
+        if interpolate not in self._x_objects:
+            self._x_objects[interpolate] = _image_x_object(
+                self._pillow_image, interpolate,
+                'images' in self._optimize_size, self._image_data)
+        # Streams are not shared, as their numbers are set when they are added
+        # to a PDF, but copying them keeps the same bytes objects
+        return copy.deepcopy(self._x_objects[interpolate])
+
     def draw(self, stream, concrete_width, concrete_height, image_rendering):
         if self._intrinsic_width <= 0 or self._intrinsic_height <= 0:
             return
 
-        image_name = stream.add_image(
-            self._pillow_image, image_rendering, self._optimize_size)
+        image_name = stream.add_image(self, image_rendering)
         stream.transform(
             concrete_width, 0, 0, -concrete_height, 0, concrete_height)
         stream.draw_x_object(image_name)
 
 
+# Rough memory footprint of a parsed SVG node, used to estimate the size of
+# SVG images in ImageCache
+SVG_NODE_SIZE = 2048
+
+
 class SVGImage:
     def __init__(self, tree, base_url, url_fetcher, context):
         self._svg = SVG(tree, base_url)
         self._base_url = base_url
         self._url_fetcher = url_fetcher
         self._context = context
+        self._elements = sum(1 for _ in tree.iter())
+
+    @property
+    def memory_size(self):
+        """Estimated size of the image in memory, in bytes."""
+        return self._elements * SVG_NODE_SIZE
 
     def get_intrinsic_size(self, image_resolution, font_size):
         width, height = self._svg.get_intrinsic_size(font_size)
@@ -131,13 +335,102 @@ def get_image_from_uri(cache, url_fetcher, optimize_size, url,
                 else:
                     # Store image id to enable cache in Stream.add_image
                     image_id = hash(url)
-                    image = RasterImage(pillow_image, image_id, optimize_size)
+                    image = RasterImage(
+                        pillow_image, image_id, optimize_size, string)
 
     except (URLFetchingError, ImageLoadingError) as exception:
         LOGGER.error('Failed to load image at %r: %s', url, exception)
         image = None
     cache[url] = image
-    return image
+    # Image may have been replaced by an identical image already cached
+    return cache.get(url, image)
+
+
+class ImageCache:
+    """Image cache, shared by documents.
+
+    This cache can be given as ``image_cache`` to :meth:`HTML.render` and
+    :meth:`HTML.write_pdf` to share images between multiple documents. Images
+    are kept decoded, and their PDF data is kept once encoded.
+
+    :param int max_size:
+        Maximum estimated size of the images in memory, in bytes. Least
+        recently used images are removed when this size is reached.
+    :param bool content_keys:
+        Whether images are also identified by their content, so that identical
+        images found at different URLs are stored once.
+
+    """
+    def __init__(self, max_size=256 * 1024 * 1024, content_keys=False):
+        self.max_size = max_size
+        self.content_keys = content_keys
+        # URL -> key, key -> image, key -> URLs, key -> estimated size
+        self._keys = {}
+        self._images = OrderedDict()
+        self._urls = {}
+        self._sizes = {}
+        self._size = 0
+
+    def __contains__(self, url):
+        return url in self._keys
+
+    def __getitem__(self, url):
+        key = self._keys[url]
+        self._images.move_to_end(key)
+        # Size may have changed since the image has been stored, when it has
+        # been encoded
+        self._update_size(key)
+        return self._images[key]
+
+    def __setitem__(self, url, image):
+        key = url
+        if self.content_keys and getattr(image, '_image_data', None):
+            key = hashlib.sha256(image._image_data).digest()
+        old_key = self._keys.get(url)
+        if old_key is not None and old_key != key:
+            self._urls[old_key].discard(url)
+        self._keys[url] = key
+        if key in self._images:
+            self._images.move_to_end(key)
+            self._urls[key].add(url)
+            self._update_size(key)
+        else:
+            self._images[key] = image
+            self._urls[key] = {url}
+            self._sizes[key] = 0
+            self._update_size(key)
+            self._evict()
+
+    def __len__(self):
+        return len(self._images)
+
+    def get(self, url, default=None):
+        return self[url] if url in self else default
+
+    def clear(self):
+        self._keys.clear()
+        self._images.clear()
+        self._urls.clear()
+        self._sizes.clear()
+        self._size = 0
+
+    @property
+    def size(self):
+        """Estimated size of the cached images in memory, in bytes."""
+        return self._size
+
+    def _update_size(self, key):
+        image = self._images[key]
+        size = 0 if image is None else image.memory_size
+        self._size += size - self._sizes[key]
+        self._sizes[key] = size
+
+    def _evict(self):
+        while self._size > self.max_size and len(self._images) > 1:
+            key, _ = self._images.popitem(last=False)
+            self._size -= self._sizes.pop(key)
+            for url in self._urls.pop(key):
+                del self._keys[url]
 
 
 def process_color_stops(vector_length, positions):
@@ -10,7 +10,7 @@ See http://www.w3.org/TR/CSS21/cascade.html#used-value
 
 """
 
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 from functools import partial
 from math import inf
 
@@ -99,19 +99,116 @@ def layout_fixed_boxes(context, pages, containing_page):
                 absolute_boxes = new_absolute_boxes
 
 
+def needs_repagination(context):
+    """Return whether laying out a page may depend on the following pages.
+
+    Page-based counters in the content and in string sets, ``target-*``
+    functions, ``pages`` counters and ``target-*`` functions in page margins,
+    and fixed boxes (displayed on all the pages) require the whole document
+    to be laid out before pages are finished.
+
+    """
+    if context.target_collector.counter_lookup_items:
+        return True
+    if context.style_for.uses_fixed_position:
+        return True
+    return context.style_for.page_rules_use_following_pages()
+
+
+def finish_page(context, pages, page, index, watch_elements):
+    """Add margin boxes, fixed boxes, strings sets and bookmarks to a page.
+
+    ``index`` is the index of ``page`` in the document. ``pages`` is the list
+    of all the laid out pages whose fixed boxes are displayed on ``page``, or
+    an empty tuple when pages are finished one by one. ``watch_elements`` is a
+    tuple of three lists, storing elements whose bookmarks have already been
+    set for elements, ``::before`` and ``::after`` pseudo-elements.
+
+    """
+    # We need the updated page_counter_values
+    _, _, _, page_state, _ = context.page_maker[index + 1]
+    page_counter_values = page_state[1]
+
+    for child in page.descendants():
+        # Only one bookmark per original box
+        if child.bookmark_label:
+            if child.element_tag.endswith('::before'):
+                checklist = watch_elements[1]
+            elif child.element_tag.endswith('::after'):
+                checklist = watch_elements[2]
+            else:
+                checklist = watch_elements[0]
+            if child.element in checklist:
+                child.bookmark_label = ''
+            else:
+                checklist.append(child.element)
+
+        if child.missing_link:
+            for (box, css_token), item in (
+                    context.target_collector.counter_lookup_items.items()):
+                if child.missing_link == box and css_token != 'content':
+                    if (css_token == 'bookmark-label' and
+                            not child.bookmark_label):
+                        # don't refill it!
+                        continue
+                    item.parse_again(page_counter_values)
+                    # string_set is a pointer, but the bookmark_label is
+                    # just a string: copy it
+                    if css_token == 'bookmark-label':
+                        child.bookmark_label = box.bookmark_label
+        # Collect the string_sets in the LayoutContext
+        string_sets = child.string_set
+        if string_sets and string_sets != 'none':
+            for string_set in string_sets:
+                string_name, text = string_set
+                context.string_set[string_name][index + 1].append(text)
+
+    # Add margin boxes
+    root_children = []
+    root, footnote_area = page.children
+    root_children.extend(layout_fixed_boxes(context, pages[:index], page))
+    root_children.extend(root.children)
+    root_children.extend(layout_fixed_boxes(context, pages[index + 1:], page))
+    root.children = root_children
+    context.current_page = index + 1  # page_number starts at 1
+
+    # page_maker's page_state is ready for the MarginBoxes
+    state = context.page_maker[context.current_page][3]
+    page.children = (root,)
+    if footnote_area.children:
+        page.children += (footnote_area,)
+    page.children += tuple(make_margin_boxes(context, page, state))
+    layout_backgrounds(page, context.get_image_from_uri)
+    return page
+
+
 def layout_document(html, root_box, context, max_loops=8):
     """Lay out the whole document.
 
     This includes line breaks, page breaks, absolute size and position for all
     boxes. Page based counters might require multiple passes.
 
+    When no page depends on the following pages (see
+    :func:`needs_repagination`), pages are yielded as soon as they are laid
+    out, and the caller can release them before the next page is created.
+    Otherwise, all the pages are laid out, possibly multiple times, before
+    being yielded.
+
     :param root_box: root of the box tree (formatting structure of the html)
                      the pages' boxes are created from that tree, i.e. this
                      structure is not lost during pagination
-    :returns: a list of laid out Page objects.
+    :returns: a generator of laid out Page objects.
 
     """
     initialize_page_maker(context, root_box)
+
+    if not needs_repagination(context):
+        watch_elements = ([], [], [])
+        pages = make_all_pages(context, root_box, html, [])
+        for i, page in enumerate(pages):
+            yield finish_page(context, (), page, i, watch_elements)
+        return
+
     pages = []
     original_footnotes = []
     actual_total_pages = 0
@@ -150,72 +247,14 @@ def layout_document(html, root_box, context, max_loops=8):
     # make_page because they dont create boxes, only appear in MarginBoxes and
     # in the final PDF.
     # Prevent repetition of bookmarks (see #1145).
-
-    watch_elements = []
-    watch_elements_before = []
-    watch_elements_after = []
-    for i, page in enumerate(pages):
-        # We need the updated page_counter_values
-        _, _, _, page_state, _ = context.page_maker[i + 1]
-        page_counter_values = page_state[1]
-
-        for child in page.descendants():
-            # Only one bookmark per original box
-            if child.bookmark_label:
-                if child.element_tag.endswith('::before'):
-                    checklist = watch_elements_before
-                elif child.element_tag.endswith('::after'):
-                    checklist = watch_elements_after
-                else:
-                    checklist = watch_elements
-                if child.element in checklist:
-                    child.bookmark_label = ''
-                else:
-                    checklist.append(child.element)
-
-            if child.missing_link:
-                for (box, css_token), item in (
-                        context.target_collector.counter_lookup_items.items()):
-                    if child.missing_link == box and css_token != 'content':
-                        if (css_token == 'bookmark-label' and
-                                not child.bookmark_label):
-                            # don't refill it!
-                            continue
-                        item.parse_again(page_counter_values)
-                        # string_set is a pointer, but the bookmark_label is
-                        # just a string: copy it
-                        if css_token == 'bookmark-label':
-                            child.bookmark_label = box.bookmark_label
-            # Collect the string_sets in the LayoutContext
-            string_sets = child.string_set
-            if string_sets and string_sets != 'none':
-                for string_set in string_sets:
-                    string_name, text = string_set
-                    context.string_set[string_name][i+1].append(text)
-
-    # Add margin boxes
+    watch_elements = ([], [], [])
     for i, page in enumerate(pages):
-        root_children = []
-        root, footnote_area = page.children
-        root_children.extend(layout_fixed_boxes(context, pages[:i], page))
-        root_children.extend(root.children)
-        root_children.extend(layout_fixed_boxes(context, pages[i + 1:], page))
-        root.children = root_children
-        context.current_page = i + 1  # page_number starts at 1
-
-        # page_maker's page_state is ready for the MarginBoxes
-        state = context.page_maker[context.current_page][3]
-        page.children = (root,)
-        if footnote_area.children:
-            page.children += (footnote_area,)
-        page.children += tuple(make_margin_boxes(context, page, state))
-        layout_backgrounds(page, context.get_image_from_uri)
-        yield page
+        yield finish_page(context, pages, page, i, watch_elements)
 
 
 class LayoutContext:
     def __init__(self, style_for, get_image_from_uri, font_config,
-                 counter_style, target_collector):
+                 counter_style, target_collector, cache=None):
         self.style_for = style_for
         self.get_image_from_uri = partial(get_image_from_uri, context=self)
         self.font_config = font_config
@@ -235,11 +274,23 @@ class LayoutContext:
         self.forced_break = False
         self.broken_out_of_flow = []
 
-        # Cache
-        self.strut_layouts = {}
-        self.font_features = {}
+        # Cache, the given dictionary can be shared between documents using
+        # the same font configuration. Caches depending on fonts are emptied
+        # when fonts have been added to the configuration since they have been
+        # filled, by @font-face rules of another document for example.
+        if cache is None:
+            cache = {}
+        generations = cache.setdefault('font_generations', {})
+        for key in ('strut_layouts', 'font_features', 'min_content_widths'):
+            if generations.get(key) != font_config.generation:
+                cache[key] = {}
+                generations[key] = font_config.generation
+        self.strut_layouts = cache['strut_layouts']
+        self.font_features = cache['font_features']
         self.tables = {}
-        self.dictionaries = {}
+        self.text_measures = OrderedDict()
+        self.dictionaries = cache.setdefault('dictionaries', {})
+        self.min_content_widths = cache['min_content_widths']
 
     def overflows_page(self, bottom_space, position_y):
         # Use a small fudge factor to avoid floating numbers errors.
@@ -277,7 +277,7 @@ def remove_last_whitespace(context, box):
 
 def first_letter_to_box(box, skip_stack, first_letter_style):
     """Create a box for the ::first-letter selector."""
-    if first_letter_style and box.children:
+    if first_letter_style is not None and box.children:
         # Some properties must be ignored in first-letter boxes.
         # https://drafts.csswg.org/selectors-3/#application-in-css
         # At least, position is ignored to avoid layout troubles.
@@ -912,7 +912,7 @@ def split_text_box(context, box, available_width, skip, is_line_start=True):
     # resume_at is not set). One code point is one or more byte, so
     # UTF-8 indexes are always bigger or equal to Unicode indexes.
     new_text = layout.text
-    encoded = text.encode()
+    encoded = text[:max(length, resume_index or 0)].encode()
     if resume_index is not None:
         between = encoded[length:resume_index].decode()
         resume_index = len(encoded[:resume_index].decode())
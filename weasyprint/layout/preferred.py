@@ -12,7 +12,7 @@ import sys
 from math import inf
 
 from ..formatting_structure import boxes
-from ..text.line_break import split_first_line
+from ..text.line_break import min_content_line_widths, split_first_line
 from .replaced import default_image_sizing
 
 
@@ -293,9 +293,13 @@ def inline_line_widths(context, box, outer, is_line_start, minimum,
             child_text = child.text[(skip or 0):]
             if is_line_start and space_collapse:
                 child_text = child_text.lstrip(' ')
+            lines = None
             if minimum and child_text == ' ':
                 lines = [0, 0]
-            else:
+            elif minimum and not first_line:
+                lines = min_content_line_widths(
+                    child_text, child.style, context)
+            if lines is None:
                 max_width = 0 if minimum else None
                 lines = []
                 resume_index = new_resume_index = 0
@@ -0,0 +1,275 @@
+"""Render multiple documents with shared resources."""
+
+import multiprocessing
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from . import CSS, HTML
+from .css.counters import CounterStyle
+from .document import Document
+from .images import ImageCache
+from .text.fonts import FontConfiguration
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    # Not available on Windows
+    resource = None
+
+# Renderer and options used by worker processes, set by _initialize_worker
+_worker = {}
+
+
+class Renderer:
+    """Long-lived renderer sharing resources between documents.
+
+    Creating a font configuration, parsing user stylesheets, loading images,
+    hyphenation dictionaries and font metrics is done once and shared by all
+    the documents rendered by the same renderer.
+
+    The user agent stylesheets are parsed once when WeasyPrint is imported, and
+    are shared by all the documents, whether they use a renderer or not.
+
+    ``@font-face`` and ``@counter-style`` rules are handled as usual, but
+    counter styles defined by a document are only available for this document,
+    whereas fonts loaded by a document are kept in the renderer's font
+    configuration. These fonts are then available for the next documents, even
+    for documents that don't declare them, and fonts declared later with the
+    same family name are added to them. Use different renderers for documents
+    that must not share their fonts.
+
+    :param list stylesheets:
+        An optional list of user stylesheets. List elements are
+        :class:`weasyprint.CSS` objects, filenames, URLs, or file objects.
+        (See :ref:`Stylesheet Origins`.) :class:`weasyprint.CSS` objects
+        must have been created with the same ``font_config`` and
+        ``counter_style`` as the renderer.
+    :param bool presentational_hints:
+        Whether HTML presentational hints are followed.
+    :param tuple optimize_size:
+        Optimize size of generated PDF. Can contain "images" and "fonts".
+    :type font_config: :class:`text.fonts.FontConfiguration`
+    :param font_config:
+        A font configuration handling ``@font-face`` rules. A new one is
+        created if not provided.
+    :type counter_style: :class:`css.counters.CounterStyle`
+    :param counter_style:
+        A dictionary storing ``@counter-style`` rules, shared by all the
+        documents. A new one is created if not provided.
+    :param str media_type:
+        The media type used for ``@media`` in user stylesheets.
+    :param int cache_size:
+        Maximum number of items stored in each layout cache between documents.
+        A cache growing larger than this limit is emptied after the end of the
+        document's rendering.
+    :type image_cache: :class:`images.ImageCache`
+    :param image_cache:
+        A cache storing images, shared by all the documents. A new one is
+        created if not provided.
+    :type font_cache: :class:`text.fonts.FontSubsetCache`
+    :param font_cache:
+        A cache storing subsetted fonts, shared by all the documents.
+
+    """
+    def __init__(self, stylesheets=None, presentational_hints=False,
+                 optimize_size=('fonts',), font_config=None,
+                 counter_style=None, media_type='print', cache_size=1000,
+                 font_cache=None, image_cache=None):
+        if font_config is None:
+            font_config = FontConfiguration()
+        if counter_style is None:
+            counter_style = CounterStyle()
+        self.font_config = font_config
+        self.counter_style = counter_style
+        self.presentational_hints = presentational_hints
+        self.optimize_size = optimize_size
+        self.cache_size = cache_size
+        self.font_cache = font_cache
+        self.image_cache = ImageCache() if image_cache is None else image_cache
+        self.stylesheets = [
+            css if hasattr(css, 'matcher') else CSS(
+                guess=css, media_type=media_type, font_config=font_config,
+                counter_style=counter_style)
+            for css in stylesheets or []]
+        # The image cache may be shared with other renderers, keep its images
+        self._layout_cache = {}
+
+    def clear(self):
+        """Empty the caches shared by documents.
+
+        Fonts are kept, create a new renderer to release them.
+
+        """
+        self.image_cache.clear()
+        self._layout_cache = {}
+
+    def _trim_caches(self):
+        # Image cache is bounded by itself
+        for cache in self._layout_cache.values():
+            if len(cache) > self.cache_size:
+                cache.clear()
+
+    def render(self, html, stylesheets=None):
+        """Lay out and paginate a document, but do not (yet) export it.
+
+        :type html: :class:`weasyprint.HTML`
+        :param html: The document to render.
+        :param list stylesheets:
+            An optional list of user stylesheets, added to the renderer's
+            stylesheets for this document only.
+        :returns: A :class:`document.Document` object.
+
+        """
+        # Counter styles defined by the document are not shared
+        counter_style = CounterStyle(self.counter_style)
+        stylesheets = [*self.stylesheets, *(stylesheets or [])]
+        document = Document._render(
+            html, stylesheets, self.presentational_hints, self.optimize_size,
+            self.font_config, counter_style, self.image_cache,
+            self._layout_cache)
+        self._trim_caches()
+        return document
+
+    def write_pdf(self, html, target=None, stylesheets=None, zoom=1,
+                  attachments=None, finisher=None):
+        """Render a document to a PDF file.
+
+        This is a shortcut for calling :meth:`render`, then
+        :meth:`Document.write_pdf() <document.Document.write_pdf>`.
+
+        :type html: :class:`weasyprint.HTML`
+        :param html: The document to render.
+        :type target:
+            :class:`str`, :class:`pathlib.Path` or :term:`file object`
+        :param target:
+            A filename where the PDF file is generated, a file object, or
+            :obj:`None`.
+        :param list stylesheets:
+            An optional list of user stylesheets, added to the renderer's
+            stylesheets for this document only.
+        :param float zoom:
+            The zoom factor in PDF units per CSS units.
+        :param list attachments: A list of additional file attachments for the
+            generated PDF document or :obj:`None`.
+        :param finisher: A finisher function, that accepts the document and a
+            :class:`pydyf.PDF` object as parameters, can be passed to perform
+            post-processing on the PDF right before the trailer is written.
+        :returns:
+            The PDF as :obj:`bytes` if ``target`` is not provided or
+            :obj:`None`, otherwise :obj:`None` (the PDF is written to
+            ``target``).
+
+        """
+        return self.render(html, stylesheets).write_pdf(
+            target, zoom, attachments, finisher, self.font_cache)
+
+    def write_pdfs(self, jobs, processes=None, timeout=None,
+                   memory_limit=None, attachments=None):
+        """Render multiple documents to PDF files in parallel.
+
+        Documents are rendered by a pool of worker processes, forked from the
+        current process once the fonts and the stylesheets of the renderer are
+        loaded. Each worker writes the PDF files directly to their targets.
+
+        Parallel rendering relies on the "fork" start method of
+        :mod:`multiprocessing`. When it is not available, documents are
+        rendered sequentially in the current process, without timeouts and
+        memory limits.
+
+        :param jobs:
+            An iterable of ``(source, target)`` tuples. ``source`` is a
+            filename or an URL, or a dictionary of keyword arguments given to
+            :class:`weasyprint.HTML`. ``target`` is the filename where the PDF
+            file is generated.
+        :param int processes:
+            The number of worker processes, defaults to the number of CPUs.
+        :param float timeout:
+            The maximum number of seconds allowed to render each document.
+        :param int memory_limit:
+            The maximum size in bytes of each worker process's memory.
+        :param list attachments: A list of additional file attachments for
+            each generated PDF document or :obj:`None`.
+        :returns:
+            An iterator of ``(target, error)`` tuples, in the same order as
+            ``jobs``. ``error`` is :obj:`None` if the document has been
+            rendered, the exception raised during the rendering, or a
+            :class:`concurrent.futures.process.BrokenProcessPool` exception if
+            the worker rendering the document has been killed.
+
+        """
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            _initialize_worker(self, None, None, attachments)
+            yield from map(_render_job, jobs)
+            return
+
+        # Fork workers with the already loaded renderer, initializer arguments
+        # are not pickled when processes are forked
+        context = multiprocessing.get_context('fork')
+        initargs = (self, timeout, memory_limit, attachments)
+        pending = list(jobs)
+        while pending:
+            with ProcessPoolExecutor(
+                    processes, context, _initialize_worker,
+                    initargs) as executor:
+                futures = [
+                    executor.submit(_render_job, job) for job in pending]
+                for future in futures:
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        # A worker has been killed, by the system when it
+                        # used too much memory for example
+                        break
+                    pending.pop(0)
+                    yield result
+            if pending:
+                # Render the first job again alone, to know whether it killed
+                # its worker, and render the following jobs in a new pool
+                yield _render_job_alone(pending.pop(0), context, initargs)
+
+
+def _initialize_worker(renderer, timeout, memory_limit, attachments):
+    """Store the renderer and the jobs options in the worker process."""
+    if memory_limit is not None and resource is not None:
+        _, hard_limit = resource.getrlimit(resource.RLIMIT_AS)
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, hard_limit))
+    _worker.update(
+        renderer=renderer, timeout=timeout, attachments=attachments)
+
+
+def _render_job_alone(job, context, initargs):
+    """Render one document in a new worker process."""
+    with ProcessPoolExecutor(
+            1, context, _initialize_worker, initargs) as executor:
+        try:
+            return executor.submit(_render_job, job).result()
+        except BrokenProcessPool as exception:
+            _, target = job
+            return target, exception
+
+
+def _raise_timeout(signal_number, frame):
+    raise TimeoutError('Document rendering took too long')
+
+
+def _render_job(job):
+    """Render one document in a worker process, return ``(target, error)``."""
+    source, target = job
+    timeout = _worker['timeout']
+    if timeout:
+        signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        if isinstance(source, dict):
+            html = HTML(**source)
+        else:
+            html = HTML(source)
+        _worker['renderer'].write_pdf(
+            html, target, attachments=_worker['attachments'])
+    except Exception as exception:
+        return target, exception
+    finally:
+        if timeout:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    return target, None
@@ -147,7 +147,6 @@ def text(svg, node, font_size):
              svg.cursor_d_position[1]))
         bounding_box = extend_bounding_box(bounding_box, points)
 
-        layout.reactivate(style)
         svg.fill_stroke(node, font_size, text=True)
         emojis = draw_first_line(
             svg.stream, TextBox(layout, style), 'none', 'none',
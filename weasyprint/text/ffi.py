@@ -192,6 +192,7 @@ ffi.cdef('''
 
     double pango_units_to_double (int i);
     int pango_units_from_double (double d);
+    gpointer g_object_ref (gpointer object);
     void g_object_unref (gpointer object);
     void g_type_init (void);
 
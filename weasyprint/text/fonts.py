@@ -124,9 +124,28 @@ class FontConfiguration:
         self._filenames = []
         self._woff_cache = {}
 
+        # Pango contexts, font descriptions and font metrics shared by
+        # layouts, see text.line_break.Layout
+        self.pango_contexts = {}
+        self.font_descriptions = {}
+        self.font_metrics = {}
+
+        # Incremented when fonts are added, caches storing values measured
+        # with this configuration are outdated when it changes
+        self.generation = 0
+
+    def clear_pools(self):
+        """Clear Pango objects shared by layouts."""
+        self.pango_contexts.clear()
+        self.font_descriptions.clear()
+        self.font_metrics.clear()
+        self.generation += 1
+
     def add_font_face(self, rule_descriptors, url_fetcher):
         if self.font_map is None:
             return
+        # Metrics may change with new fonts
+        self.clear_pools()
         for font_type, url in rule_descriptors['src']:
             if url is None:
                 continue
@@ -296,6 +315,89 @@ class FontConfiguration:
                 continue
 
 
+class FontSubsetCache:
+    """On-disk cache of the font files embedded in PDF documents.
+
+    Subsetting fonts is slow, particularly for large fonts. When the same fonts
+    are used with the same glyphs, for example in documents generated from the
+    same template, the subsetted fonts stored in this cache are embedded
+    instead.
+
+    The cache can be shared between documents, processes and runs. When its
+    size is larger than ``max_size``, the least recently used fonts are
+    removed.
+
+    :param folder: The path of the folder where fonts are stored.
+    :type folder: str or pathlib.Path
+    :param int max_size: The maximum size of the cache in bytes.
+
+    """
+    def __init__(self, folder, max_size=100 * 1024 * 1024):
+        self._folder = pathlib.Path(folder)
+        self._folder.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+
+    @staticmethod
+    def key(content, index, glyphs, options):
+        """Get the cache key for a font.
+
+        :param bytes content: The content of the whole font file.
+        :param int index: The index of the font face in the font file.
+        :param glyphs: The glyph ids kept in the font, or :obj:`None`.
+        :param bytes options: The options used to build the font program.
+
+        """
+        sha = hashlib.sha256(content)
+        sha.update(f'#{index}#'.encode())
+        if glyphs is not None:
+            sha.update(','.join(map(str, sorted(glyphs))).encode())
+        sha.update(b'#' + options)
+        return sha.hexdigest()
+
+    def get(self, key):
+        """Return the font file stored for ``key``, or :obj:`None`."""
+        path = self._folder / key
+        try:
+            content = path.read_bytes()
+            # Update modification time, used to find least recently used fonts
+            os.utime(path)
+        except OSError:
+            return None
+        return content
+
+    def set(self, key, content):
+        """Store the font file ``content`` for ``key``."""
+        # Write in a temporary file first, so that other processes never read
+        # partially written files
+        file_descriptor, filename = tempfile.mkstemp(
+            dir=self._folder, suffix='.tmp')
+        with open(file_descriptor, 'wb') as fd:
+            fd.write(content)
+        os.replace(filename, self._folder / key)
+        self._evict()
+
+    def _evict(self):
+        """Remove least recently used fonts until the cache is small enough."""
+        files = []
+        for path in self._folder.iterdir():
+            if path.suffix == '.tmp':
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        size = sum(file_size for _, file_size, _ in files)
+        for _, file_size, path in sorted(files, key=lambda file: file[0]):
+            if size <= self.max_size:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            size -= file_size
+
+
 def font_features(font_kerning='normal', font_variant_ligatures='normal',
                   font_variant_position='normal', font_variant_caps='normal',
                   font_variant_numeric='normal',
@@ -1,6 +1,8 @@
 """Decide where to break text lines."""
 
 import re
+from collections import namedtuple
+from copy import copy
 from math import inf
 
 import pyphen
@@ -11,6 +13,21 @@ from .ffi import (
     units_to_double)
 from .fonts import font_features
 
+# Leading spaces, first word and following space
+NEXT_WORD_RE = re.compile(' *[^ ]+ ')
+
+# Glyphs of a Pango run, see get_glyph_runs
+GlyphRun = namedtuple(
+    'GlyphRun', 'font glyphs clusters num_glyphs offset length')
+
+# Maximum number of Pango objects shared in each font configuration pool
+POOL_MAX_SIZE = 1024
+
+# Maximum number of texts fitting in one line whose measures are kept by each
+# layout context, with the number of cache hits and misses
+TEXT_MEASURES_MAX_SIZE = 4096
+TEXT_MEASURES_STATS = {'hits': 0, 'misses': 0}
+
 
 def line_size(line, style):
     """Get logical width and height of the given ``line``.
@@ -28,6 +45,16 @@ def line_size(line, style):
     return width, height
 
 
+def utf8_prefix(text, length):
+    """Get the text of the ``length`` first UTF-8 bytes of ``text``.
+
+    Only the beginning of ``text`` is encoded, as code points are encoded with
+    at least one byte.
+
+    """
+    return text[:length].encode()[:length].decode()
+
+
 def first_line_metrics(first_line, text, layout, resume_at, space_collapse,
                        style, hyphenated=False, hyphenation_character=None):
     length = first_line.length
@@ -40,7 +67,7 @@ def first_line_metrics(first_line, text, layout, resume_at, space_collapse,
         pango.pango_layout_set_width(layout.layout, -1)
 
         # Create layout with final text
-        first_line_text = text.encode()[:length].decode()
+        first_line_text = utf8_prefix(text, length)
 
         # Remove trailing spaces if spaces collapse
         if space_collapse:
@@ -52,15 +79,110 @@ def first_line_metrics(first_line, text, layout, resume_at, space_collapse,
 
     width, height = line_size(first_line, style)
     baseline = units_to_double(pango.pango_layout_get_baseline(layout.layout))
-    layout.deactivate()
+    layout.deactivate(keep_glyph_runs=True)
     return layout, length, resume_at, width, height, baseline
 
 
+def _pool_get(pool, key, create):
+    """Get ``key`` from ``pool``, creating the value if needed."""
+    if key not in pool:
+        if len(pool) >= POOL_MAX_SIZE:
+            pool.clear()
+        pool[key] = create()
+    return pool[key]
+
+
+def get_pango_context(font_config, lang):
+    """Get a Pango context and a Pango language for ``lang``.
+
+    Contexts are shared between layouts using the same ``font_config``, they
+    must not be modified.
+
+    """
+    def create():
+        if font_config is None:
+            font_map = ffi.gc(
+                pangoft2.pango_ft2_font_map_new(), gobject.g_object_unref)
+        else:
+            font_map = font_config.font_map
+        pango_context = ffi.gc(
+            pango.pango_font_map_create_context(font_map),
+            gobject.g_object_unref)
+        pango.pango_context_set_round_glyph_positions(pango_context, False)
+        if lang:
+            lang_p, _ = unicode_to_char_p(lang)
+            language = pango.pango_language_from_string(lang_p)
+            pango.pango_context_set_language(pango_context, language)
+        else:
+            language = pango.pango_language_get_default()
+        return pango_context, language
+
+    if font_config is None:
+        return create()
+    return _pool_get(font_config.pango_contexts, lang, create)
+
+
+def get_font_description(font_config, font_key):
+    """Get a Pango font description for ``font_key``.
+
+    ``font_key`` is a ``(family, style, stretch, weight, size)`` tuple.
+    Descriptions are copied by layouts and can be shared.
+
+    """
+    def create():
+        family, style, stretch, weight, size = font_key
+        font = ffi.gc(
+            pango.pango_font_description_new(),
+            pango.pango_font_description_free)
+        family_p, _ = unicode_to_char_p(','.join(family))
+        pango.pango_font_description_set_family(font, family_p)
+        pango.pango_font_description_set_style(font, PANGO_STYLE[style])
+        pango.pango_font_description_set_stretch(
+            font, PANGO_STRETCH[stretch])
+        pango.pango_font_description_set_weight(font, weight)
+        pango.pango_font_description_set_absolute_size(
+            font, units_from_double(size))
+        return font
+
+    if font_config is None:
+        return create()
+    return _pool_get(font_config.font_descriptions, font_key, create)
+
+
+def get_font_metrics(font_config, pango_context, font, language, key):
+    """Get ascent, underline and strikethrough metrics of ``font``.
+
+    Return a ``(ascent, underline_position, strikethrough_position,
+    underline_thickness, strikethrough_thickness)`` tuple.
+
+    """
+    def create():
+        metrics = ffi.gc(
+            pango.pango_context_get_metrics(pango_context, font, language),
+            pango.pango_font_metrics_unref)
+        return (
+            units_to_double(pango.pango_font_metrics_get_ascent(metrics)),
+            units_to_double(
+                pango.pango_font_metrics_get_underline_position(metrics)),
+            units_to_double(
+                pango.pango_font_metrics_get_strikethrough_position(metrics)),
+            units_to_double(
+                pango.pango_font_metrics_get_underline_thickness(metrics)),
+            units_to_double(
+                pango.pango_font_metrics_get_strikethrough_thickness(
+                    metrics)))
+
+    if font_config is None:
+        return create()
+    return _pool_get(font_config.font_metrics, key, create)
+
+
 class Layout:
     """Object holding PangoLayout-related cdata pointers."""
     def __init__(self, context, font_size, style, justification_spacing=0,
                  max_width=None):
         self.justification_spacing = justification_spacing
+        self.glyph_runs = None
         self.setup(context, font_size, style)
         self.max_width = max_width
 
@@ -69,65 +191,36 @@ class Layout:
         self.style = style
         self.first_line_direction = 0
 
-        if context is None:
-            font_map = ffi.gc(
-                pangoft2.pango_ft2_font_map_new(), gobject.g_object_unref)
-        else:
-            font_map = context.font_config.font_map
-        pango_context = ffi.gc(
-            pango.pango_font_map_create_context(font_map),
-            gobject.g_object_unref)
-        pango.pango_context_set_round_glyph_positions(pango_context, False)
-        self.layout = ffi.gc(
-            pango.pango_layout_new(pango_context),
-            gobject.g_object_unref)
-
         if style['font_language_override'] != 'normal':
-            lang_p, lang = unicode_to_char_p(LST_TO_ISO.get(
+            lang = LST_TO_ISO.get(
                 style['font_language_override'].lower(),
-                style['font_language_override']))
+                style['font_language_override'])
         elif style['lang']:
-            lang_p, lang = unicode_to_char_p(style['lang'])
+            lang = style['lang']
         else:
             lang = None
-            self.language = pango.pango_language_get_default()
-        if lang:
-            self.language = pango.pango_language_from_string(lang_p)
-            pango.pango_context_set_language(pango_context, self.language)
 
         assert not isinstance(style['font_family'], str), (
             'font_family should be a list')
-        self.font = ffi.gc(
-            pango.pango_font_description_new(),
-            pango.pango_font_description_free)
-        family_p, family = unicode_to_char_p(','.join(style['font_family']))
-        pango.pango_font_description_set_family(self.font, family_p)
-        pango.pango_font_description_set_style(
-            self.font, PANGO_STYLE[style['font_style']])
-        pango.pango_font_description_set_stretch(
-            self.font, PANGO_STRETCH[style['font_stretch']])
-        pango.pango_font_description_set_weight(
-            self.font, style['font_weight'])
-        pango.pango_font_description_set_absolute_size(
-            self.font, units_from_double(font_size))
+        font_key = (
+            tuple(style['font_family']), style['font_style'],
+            style['font_stretch'], style['font_weight'], font_size)
+
+        font_config = None if context is None else context.font_config
+        pango_context, self.language = get_pango_context(font_config, lang)
+        self.layout = ffi.gc(
+            pango.pango_layout_new(pango_context),
+            gobject.g_object_unref)
+        self.font = get_font_description(font_config, font_key)
         pango.pango_layout_set_font_description(self.layout, self.font)
 
         text_decoration = style['text_decoration_line']
         if text_decoration != 'none':
-            metrics = ffi.gc(
-                pango.pango_context_get_metrics(
-                    pango_context, self.font, self.language),
-                pango.pango_font_metrics_unref)
-            self.ascent = units_to_double(
-                pango.pango_font_metrics_get_ascent(metrics))
-            self.underline_position = units_to_double(
-                pango.pango_font_metrics_get_underline_position(metrics))
-            self.strikethrough_position = units_to_double(
-                pango.pango_font_metrics_get_strikethrough_position(metrics))
-            self.underline_thickness = units_to_double(
-                pango.pango_font_metrics_get_underline_thickness(metrics))
-            self.strikethrough_thickness = units_to_double(
-                pango.pango_font_metrics_get_strikethrough_thickness(metrics))
+            (self.ascent, self.underline_position,
+             self.strikethrough_position, self.underline_thickness,
+             self.strikethrough_thickness) = get_font_metrics(
+                 font_config, pango_context, self.font, self.language,
+                 (lang, font_key))
         else:
             self.ascent = None
             self.underline_position = None
@@ -143,8 +236,10 @@ class Layout:
                 f'{key} {value}' for key, value in features.items()).encode()
             # TODO: attributes should be freed.
             # In the meantime, keep a cache to avoid leaking too many of them.
-            attr = context.font_features.setdefault(
-                features, pango.pango_attr_font_features_new(features))
+            if features not in context.font_features:
+                context.font_features[features] = (
+                    pango.pango_attr_font_features_new(features))
+            attr = context.font_features[features]
             attr_list = pango.pango_attr_list_new()
             pango.pango_attr_list_insert(attr_list, attr)
             pango.pango_layout_set_attributes(self.layout, attr_list)
@@ -237,7 +332,21 @@ class Layout:
             pango.pango_tab_array_free)
         pango.pango_layout_set_tabs(self.layout, array)
 
-    def deactivate(self):
+    def deactivate(self, keep_glyph_runs=False):
+        """Free Pango objects, they are created again by ``reactivate``.
+
+        If ``keep_glyph_runs`` is set, glyphs of the first line are kept in
+        ``glyph_runs`` when they can be drawn without a new layout.
+
+        """
+        self.glyph_runs = None
+        if keep_glyph_runs and not self.justification_spacing:
+            first_line, index = self.get_first_line()
+            # Lines are drawn in single-paragraph mode
+            paragraph_break = any(
+                character in self.text for character in '\n\r\u2029')
+            if index is None and not paragraph_break:
+                self.glyph_runs = get_glyph_runs(first_line, copy=True)
         del self.layout, self.font, self.language, self.style
 
     def reactivate(self, style):
@@ -245,6 +354,41 @@ class Layout:
         self.set_text(self.text, justify=True)
 
 
+def get_glyph_runs(line, copy=False):
+    """Get the list of glyph runs of the given Pango ``line``.
+
+    If ``copy`` is set, glyphs and clusters are copied into new arrays, and
+    runs can be used after the layout of ``line`` is freed.
+
+    """
+    runs = []
+    run = line.runs
+    while run != ffi.NULL:
+        glyph_item = ffi.cast('PangoGlyphItem *', run.data)
+        glyph_string = glyph_item.glyphs
+        num_glyphs = glyph_string.num_glyphs
+        font = glyph_item.item.analysis.font
+        glyphs = glyph_string.glyphs
+        clusters = glyph_string.log_clusters
+        if copy:
+            font = ffi.gc(
+                ffi.cast('PangoFont *', gobject.g_object_ref(font)),
+                gobject.g_object_unref)
+            glyphs = ffi.new('PangoGlyphInfo[]', num_glyphs)
+            ffi.memmove(
+                glyphs, glyph_string.glyphs,
+                ffi.sizeof('PangoGlyphInfo') * num_glyphs)
+            clusters = ffi.new('int[]', num_glyphs)
+            ffi.memmove(
+                clusters, glyph_string.log_clusters,
+                ffi.sizeof('int') * num_glyphs)
+        runs.append(GlyphRun(
+            font, glyphs, clusters, num_glyphs, glyph_item.item.offset,
+            glyph_item.item.length))
+        run = run.next
+    return runs
+
+
 def create_layout(text, style, context, max_width, justification_spacing):
     """Return an opaque Pango layout with default Pango line-breaks.
 
@@ -269,6 +413,35 @@ def create_layout(text, style, context, max_width, justification_spacing):
     return layout
 
 
+def text_measure_key(text, style, justification_spacing):
+    """Get the key of the measures of ``text`` drawn with ``style``."""
+    return (
+        text, justification_spacing, tuple(style['font_family']),
+        style['font_style'], style['font_stretch'], style['font_weight'],
+        style['font_size'], style['font_language_override'], style['lang'],
+        style['font_kerning'], style['font_variant_ligatures'],
+        style['font_variant_position'], style['font_variant_caps'],
+        style['font_variant_numeric'], style['font_variant_alternates'],
+        style['font_variant_east_asian'], style['font_feature_settings'],
+        style['letter_spacing'], style['word_spacing'], style['white_space'],
+        style['overflow_wrap'], style['tab_size'],
+        style['text_decoration_line'])
+
+
+def store_text_measure(context, key, metrics):
+    """Keep the measures of a text fitting in one line in ``context``.
+
+    Least recently used measures are removed when the cache is full.
+
+    """
+    layout, length, _, width, height, baseline = metrics
+    measures = context.text_measures
+    if len(measures) >= TEXT_MEASURES_MAX_SIZE:
+        measures.popitem(last=False)
+    # Returned layouts may be changed when drawn, keep a copy
+    measures[key] = (copy(layout), length, width, height, baseline)
+
+
 def split_first_line(text, style, context, max_width, justification_spacing,
                      is_line_start=True, minimum=False):
     """Fit as much as possible in the available width for one line of text.
@@ -294,6 +467,21 @@ def split_first_line(text, style, context, max_width, justification_spacing,
     if not text_wrap:
         max_width = None
 
+    # Step #0: Use the measures of the same text if it fits in the line
+    measure_key = None
+    if context is not None and style['font_size']:
+        measure_key = text_measure_key(text, style, justification_spacing)
+        measure = context.text_measures.get(measure_key)
+        if measure is not None and (
+                max_width is None or measure[2] <= max_width):
+            TEXT_MEASURES_STATS['hits'] += 1
+            context.text_measures.move_to_end(measure_key)
+            layout, length, width, height, baseline = measure
+            layout = copy(layout)
+            layout.max_width = original_max_width
+            return layout, length, None, width, height, baseline
+        TEXT_MEASURES_STATS['misses'] += 1
+
     # Step #1: Get a draft layout with the first line
     layout = None
     if max_width is not None and max_width != inf and style['font_size']:
@@ -306,17 +494,23 @@ def split_first_line(text, style, context, max_width, justification_spacing,
             else:
                 expected_length = space_index + 2  # index + space + one letter
         else:
-            expected_length = int(max_width / style['font_size'] * 2.5)
-        if expected_length < len(text):
-            # Try to use a small amount of text instead of the whole text
+            expected_length = max(
+                1, int(max_width / style['font_size'] * 2.5))
+        while expected_length < len(text):
+            # Try to use a small amount of text instead of the whole text, as
+            # the whole text is shaped by Pango even if only the first line
+            # is needed
             layout = create_layout(
                 text[:expected_length], style, context, max_width,
                 justification_spacing)
             first_line, index = layout.get_first_line()
-            if index is None:
-                # The small amount of text fits in one line, give up and use
-                # the whole text
-                layout = None
+            if index is not None:
+                break
+            # The small amount of text fits in one line, try again with more
+            # text. The length grows geometrically, the text shaped to find
+            # the first line is proportional to the length of this line.
+            layout = None
+            expected_length *= 2
     if layout is None:
         layout = create_layout(
             text, style, context, original_max_width, justification_spacing)
@@ -326,25 +520,31 @@ def split_first_line(text, style, context, max_width, justification_spacing,
     # Step #2: Don't split lines when it's not needed
     if max_width is None:
         # The first line can take all the place needed
-        return first_line_metrics(
+        metrics = first_line_metrics(
             first_line, text, layout, resume_index, space_collapse, style)
+        if measure_key is not None and resume_index is None:
+            store_text_measure(context, measure_key, metrics)
+        return metrics
     first_line_width, _ = line_size(first_line, style)
     if index is None and first_line_width <= max_width:
         # The first line fits in the available width
-        return first_line_metrics(
+        metrics = first_line_metrics(
             first_line, text, layout, resume_index, space_collapse, style)
+        if measure_key is not None:
+            store_text_measure(context, measure_key, metrics)
+        return metrics
 
     # Step #3: Try to put the first word of the second line on the first line
     # https://mail.gnome.org/archives/gtk-i18n-list/2013-September/msg00006
     # is a good thread related to this problem.
-    first_line_text = text.encode()[:index].decode()
+    first_line_text = utf8_prefix(text, index)
     first_line_fits = (
         first_line_width <= max_width or
         ' ' in first_line_text.strip() or
         can_break_text(first_line_text.strip(), style['lang']))
     if first_line_fits:
         # The first line fits but may have been cut too early by Pango
-        second_line_text = text.encode()[index:].decode()
+        second_line_text = text[len(first_line_text):]
     else:
         # The line can't be split earlier, try to hyphenate the first word.
         first_line_text = ''
@@ -539,6 +739,62 @@ def split_first_line(text, style, context, max_width, justification_spacing,
         hyphenated, style['hyphenate_character'])
 
 
+def min_content_line_widths(text, style, context):
+    """Get the widths of the lines of ``text`` broken at each opportunity.
+
+    Return the same widths as successive calls to :func:`split_first_line`
+    with ``max_width=0`` and ``minimum=True``, but find all the break
+    opportunities at once and use one layout for the whole text. Widths are
+    cached in ``context``.
+
+    Return ``None`` when hyphenation, word breaking or preserved line breaks
+    are possible, as :func:`split_first_line` is needed in this case.
+
+    """
+    if (not text or not style['font_size'] or
+            style['white_space'] not in ('normal', 'pre-line') or
+            style['hyphens'] == 'auto' or
+            style['word_break'] == 'break-all' or
+            style['overflow_wrap'] == 'anywhere' or
+            '\t' in text or '\xad' in text):
+        return None
+
+    if context:
+        key = (
+            text, style['font_size'], style['font_language_override'],
+            style['lang'], tuple(style['font_family']), style['font_style'],
+            style['font_stretch'], style['font_weight'],
+            style['font_kerning'], style['font_variant_ligatures'],
+            style['font_variant_position'], style['font_variant_caps'],
+            style['font_variant_numeric'], style['font_variant_alternates'],
+            style['font_variant_east_asian'], style['font_feature_settings'],
+            style['letter_spacing'], style['word_spacing'])
+        if key in context.min_content_widths:
+            return context.min_content_widths[key]
+
+    _, log_attrs = get_log_attrs(text, style['lang'])
+    breaks = [0]
+    for i in range(1, len(text)):
+        if log_attrs[i].is_mandatory_break:
+            return None
+        if log_attrs[i].is_line_break:
+            breaks.append(i)
+    breaks.append(len(text))
+
+    layout = Layout(context, style['font_size'], style)
+    widths = []
+    for start, end in zip(breaks[:-1], breaks[1:]):
+        # Spaces collapse, trailing spaces are removed
+        layout.set_text(text[start:end].rstrip(' '))
+        first_line, _ = layout.get_first_line()
+        width, _ = line_size(first_line, style)
+        widths.append(width)
+
+    if context:
+        context.min_content_widths[key] = widths
+    return widths
+
+
 def get_log_attrs(text, lang):
     if lang:
         lang_p, lang = unicode_to_char_p(lang)
@@ -569,6 +825,13 @@ def can_break_text(text, lang):
 def get_next_word_boundaries(text, lang):
     if not text or len(text) < 2:
         return None
+    # Try to find the boundaries in the first space-separated word only, to
+    # avoid getting the attributes of the whole text
+    match = NEXT_WORD_RE.match(text)
+    if match and match.end() < len(text):
+        word_boundaries = get_next_word_boundaries(text[:match.end()], lang)
+        if word_boundaries is not None:
+            return word_boundaries
     bytestring, log_attrs = get_log_attrs(text, lang)
     for i, attr in enumerate(log_attrs):
         if attr.is_word_end:
@@ -5,6 +5,7 @@ import contextlib
 import os.path
 import re
 import sys
+import threading
 import traceback
 import zlib
 from gzip import GzipFile
@@ -264,3 +265,56 @@ def fetch(url_fetcher, url):
                     url, traceback.format_exc())
     else:
         yield result
+
+
+class PrefetchingURLFetcher:
+    """URL fetcher returning resources fetched in advance.
+
+    Resources given to :meth:`prefetch` are fetched by ``executor``, and are
+    returned when the fetcher is called with their URL. Other resources are
+    fetched when requested, by ``url_fetcher``.
+
+    ``callback`` is called by the executor with the URL and the result of each
+    prefetched resource, it can be used to prefetch the resources it needs.
+
+    """
+    def __init__(self, url_fetcher, executor, callback=None):
+        self._url_fetcher = url_fetcher
+        self._executor = executor
+        self._callback = callback
+        self._lock = threading.Lock()
+        self._results = {}
+
+    def prefetch(self, url):
+        if url.startswith('data:'):
+            # Already in memory
+            return
+        with self._lock:
+            if url not in self._results:
+                self._results[url] = self._executor.submit(self._fetch, url)
+
+    def _fetch(self, url):
+        result = self._url_fetcher(url)
+        if 'file_obj' in result:
+            # Read the file now, as the resource may be requested twice
+            file_obj = result.pop('file_obj')
+            try:
+                result['string'] = file_obj.read()
+            finally:
+                file_obj.close()
+        if self._callback is not None:
+            try:
+                self._callback(url, result)
+            except Exception:  # pragma: no cover
+                LOGGER.warning(
+                    'Error when prefetching resources for %s:\n%s',
+                    url, traceback.format_exc())
+        return result
+
+    def __call__(self, url):
+        with self._lock:
+            future = self._results.get(url)
+        if future is None:
+            return self._url_fetcher(url)
+        # Errors raised by the fetcher are raised again here
+        return dict(future.result())